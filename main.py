@@ -1,23 +1,173 @@
-from os.path import dirname, abspath
-from src.exchange_data import generate_forms, read_forms, write_sol
-from src.optim import solve
-from src.tests import *
+import sys
+import argparse
+from os import listdir, makedirs
+from os.path import dirname, abspath, join, isdir, getmtime
 
-import numpy as np
-from random import randint
+# Only the standard library is imported here, every command imports what it
+# needs, so e.g. generate-forms never loads the solver stack.
 
 
-def main():
-    root_dir = dirname(abspath(__file__))
-    # generate_forms(root_dir) ?
-    optim_params, names, slot_names, days = read_forms(root_dir)
-    n_p, n_d, n_s, G, T, K, indisp, forced, slot_choice, demand = optim_params
+def generate_forms_cmd(args):
+    from src.exchange_data import generate_forms
+    generate_forms(args.root)
+    return 0
 
-    prob_status, sol, value = solve(n_p, n_d, n_s, G, T, K, indisp, forced,
-                                    slot_choice, demand)
+
+def check_forms_cmd(args):
+    from src.exchange_data import read_forms, explain_conflicts
+    from src.optim import precheck
+    optim_params, names, slot_names, days = read_forms(args.root)
+    report = precheck(*optim_params, prop=args.prop)
+    # Tells the user what to change before any solve
+    for line in explain_conflicts(report, names, slot_names, days):
+        print(line)
+    if len(report) == 0:
+        print('Nenhum problema encontrado nos formulários.')
+    return 1 if report else 0
+
+
+def solve_cmd(args):
+    from src.exchange_data import (read_forms, write_sol, explain_conflicts,
+                                   check_formats)
+    from src.optim import SolveStats, solve
+    # Fails before the solve rather than after writing some of the outputs
+    check_formats(args.formats)
+    optim_params, names, slot_names, days = read_forms(args.root)
+    options = {'backend': args.backend}
+    if args.time_limit is not None:
+        options['time_limit'] = args.time_limit
+    if args.mip_gap is not None:
+        options['mip_gap'] = args.mip_gap
+    if args.shard:
+        options['shard'] = True
+    stats = SolveStats()
+    if args.no_cache:
+        prob_status, sol, value = solve(*optim_params, prop=args.prop,
+                                        stats=stats, **options)
+    else:
+        # Unchanged forms get the stored solution back instead of a new solve
+        from src.cache import SolutionCache
+        prob_status, sol, value = SolutionCache(args.root).solve(
+            optim_params, prop=args.prop, stats=stats, **options)
     print(prob_status)
-    if sol is not None:
-        write_sol(root_dir, sol, names, slot_names, days)
+    # Infeasible before the solver call, tells the user what to change
+    for line in explain_conflicts(stats.conflicts, names, slot_names, days):
+        print(line)
+    out_dir = join(args.root, 'solutions')
+    if not isdir(out_dir):
+        makedirs(out_dir)
+    # One JSON line per run, to follow where the time goes
+    stats.log(join(out_dir, 'solve_log.jsonl'))
+    if sol is None:
+        return 1
+    # The json output is the one read back by validate and export
+    formats = tuple(args.formats) + ('json',) * ('json' not in args.formats)
+    for path in write_sol(args.root, sol, names, slot_names, days,
+                          statistics=stats, formats=formats).values():
+        print(path)
+    return 0
+
+
+def latest_solution(root_dir):
+    """The most recent json solution written by solve, or None."""
+    out_dir = join(root_dir, 'solutions')
+    if not isdir(out_dir):
+        return None
+    paths = [join(out_dir, f) for f in listdir(out_dir)
+             if f.startswith('ListaSAPI_solved') and f.endswith('.json')]
+    return max(paths, key=getmtime) if paths else None
+
+
+def load_solution(args):
+    from src.exchange_data import read_forms, read_sol
+    path = args.solution or latest_solution(args.root)
+    if path is None:
+        raise IOError('Nenhuma solução encontrada em solutions, rode o'
+                      ' comando solve antes.')
+    forms = read_forms(args.root)
+    optim_params, names, slot_names, days = forms
+    return forms, read_sol(path, names, slot_names, days)
+
+
+def validate_cmd(args):
+    from src.tests import validate
+    (optim_params, names, slot_names, days), sol = load_solution(args)
+    passed, report = validate(sol, optim_params, prop=args.prop)
+    for rule, person, day, slot in report:
+        print(rule, '' if person is None else names[person],
+              days[day], '' if slot is None else slot_names[slot])
+    print('OK' if passed else '{} violações.'.format(len(report)))
+    return 0 if passed else 1
+
+
+def export_cmd(args):
+    from src.exchange_data import write_sol
+    (optim_params, names, slot_names, days), sol = load_solution(args)
+    for path in write_sol(args.root, sol, names, slot_names, days,
+                          formats=args.formats).values():
+        print(path)
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Generates the schedule from the forms of the data '
+                    'folder.')
+    parser.add_argument('--root', default=dirname(abspath(__file__)),
+                        help='Project folder, with the data folder')
+    parser.add_argument('--prop', type=float, default=0.5,
+                        help='Maximum proportion of men in each slot')
+    commands = parser.add_subparsers(dest='command')
+
+    cmd = commands.add_parser('generate-forms',
+                              help='Writes the empty forms in data')
+    cmd.set_defaults(run=generate_forms_cmd)
+
+    cmd = commands.add_parser('check-forms', help='Reads the forms and '
+                              'looks for evident infeasibilities')
+    cmd.set_defaults(run=check_forms_cmd)
+
+    formats = ['roster', 'person', 'json', 'parquet']
+    cmd = commands.add_parser('solve', help='Solves and writes the schedule')
+    cmd.add_argument('--backend', default='cvxpy',
+                     choices=['cvxpy', 'highs', 'bisection', 'heuristic',
+                              'portfolio'])
+    cmd.add_argument('--time-limit', type=float, default=None,
+                     help='Wall-clock budget of the solver, in seconds')
+    cmd.add_argument('--mip-gap', type=float, default=None)
+    cmd.add_argument('--shard', action='store_true',
+                     help='Solves the independent groups of people and '
+                          'slots in parallel')
+    cmd.add_argument('--no-cache', action='store_true',
+                     help='Solves even if the forms did not change')
+    cmd.add_argument('--formats', nargs='+', default=['roster'],
+                     choices=formats)
+    cmd.set_defaults(run=solve_cmd)
+
+    for name, run, text in [
+            ('validate', validate_cmd, 'Checks a stored solution against '
+             'the forms'),
+            ('export', export_cmd, 'Writes a stored solution in other '
+             'formats')]:
+        cmd = commands.add_parser(name, help=text)
+        cmd.add_argument('--solution', default=None, help='json solution, '
+                         'the most recent one of solutions by default')
+        if name == 'export':
+            cmd.add_argument('--formats', nargs='+', default=['person'],
+                             choices=formats)
+        cmd.set_defaults(run=run)
+
+    args = parser.parse_args(argv)
+    # Without a command it solves, as before the subcommands
+    if args.command is None:
+        args = parser.parse_args(argv + ['solve'])
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    return args.run(args)
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
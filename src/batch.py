@@ -0,0 +1,157 @@
+import sys
+import csv
+import json
+import time
+import argparse
+from os.path import join, dirname, abspath, isdir
+from os import makedirs
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from src.exchange_data import read_forms, read_demand
+from src.snapshot import load_snapshot
+
+
+# Keys of a scenario that replace the matching entry of optim_params
+PARAM_KEYS = ['G', 'T', 'M', 'indisp', 'forced', 'slot_choice', 'demand']
+
+# Set once per worker process by init_worker
+BASE_PARAMS = None
+CACHE_ROOT = None
+
+
+def apply_scenario(optim_params, scenario):
+    """Applies the overrides of a scenario on top of the parsed forms.
+
+    A scenario is a dict that can replace any of G, T, M, indisp, forced,
+    slot_choice and demand (the demand may also be the path of a
+    personnel.csv-like file), add absences with extra_indisp, and set prop,
+    name and any solver option of src.optim.solve (e.g. backend).
+
+    Returns:
+        optim_params (tuple): The parameters of the scenario
+        prop (float): The maximum proportion of men
+        options (dict): The solver options
+    """
+    n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand = optim_params
+    params = dict(G=G, T=T, M=M, indisp=indisp, forced=forced,
+                  slot_choice=slot_choice, demand=demand)
+    options = dict(scenario)
+    options.pop('name', None)
+    prop = options.pop('prop', 0.5)
+    for key in PARAM_KEYS:
+        if key in options:
+            params[key] = options.pop(key)
+    if isinstance(params['demand'], str):
+        params['demand'] = read_demand(params['demand'])[0]
+    for key in ['G', 'T', 'M', 'slot_choice', 'demand']:
+        params[key] = np.asarray(params[key], dtype=np.int8)
+    params['indisp'] = [tuple(e) for e in params['indisp']]
+    params['indisp'] += [tuple(e) for e in options.pop('extra_indisp', [])]
+    params['forced'] = [tuple(e) for e in params['forced']]
+    optim_params = (n_p, n_d, n_s) + tuple(params[k] for k in PARAM_KEYS)
+    return optim_params, prop, options
+
+
+def init_worker(optim_params, cache_root):
+    """Loads the solver stack and the base forms once per worker."""
+    global BASE_PARAMS, CACHE_ROOT
+    import src.optim
+    try:
+        # src.optim only imports cvxpy when its backend, the default one,
+        # runs. Loaded here so the first job does not pay for it
+        import cvxpy  # noqa: F401
+    except ImportError:
+        pass
+    BASE_PARAMS = optim_params
+    CACHE_ROOT = cache_root
+
+
+def run_scenario(scenario):
+    """Solves one scenario on top of BASE_PARAMS.
+
+    Returns:
+        dict: name, status, value, time (in seconds) and solution
+    """
+    from src.optim import solve
+    optim_params, prop, options = apply_scenario(BASE_PARAMS, scenario)
+    start = time.time()
+    if CACHE_ROOT is not None:
+        from src.cache import SolutionCache
+        status, sol, value = SolutionCache(CACHE_ROOT).solve(
+            optim_params, prop=prop, **options)
+    else:
+        status, sol, value = solve(*optim_params, prop=prop, **options)
+    return {'name': scenario.get('name', ''), 'status': status,
+            'value': value, 'time': time.time() - start, 'solution': sol}
+
+
+def run_batch(optim_params, scenarios, processes=None, cache_root=None):
+    """Solves every scenario over a process pool. Each worker imports the
+    solver and receives the base forms only once.
+
+    Args:
+        optim_params (tuple): The parameters returned by read_forms
+        scenarios (list): List of scenario dicts, see apply_scenario
+        processes (int): Number of worker processes, None for one per core
+        and 0 to run everything in this process
+        cache_root (str): If given, the root of a SolutionCache shared with
+        the CLI
+
+    Returns:
+        list: One result dict per scenario, in the same order
+    """
+    for i, scenario in enumerate(scenarios):
+        scenario.setdefault('name', 'scenario_{}'.format(i))
+    if processes == 0:
+        init_worker(optim_params, cache_root)
+        return [run_scenario(s) for s in scenarios]
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                             initargs=(optim_params, cache_root)) as pool:
+        return list(pool.map(run_scenario, scenarios))
+
+
+def write_results(path, results):
+    """Writes the result table as csv, and the solutions next to it as a
+    .npz file with one array per scenario name.
+    """
+    with open(path, 'w') as csv_file:
+        wr = csv.writer(csv_file, dialect='excel')
+        wr.writerow(['Scenario', 'Status', 'Value', 'Time'])
+        for r in results:
+            wr.writerow([r['name'], r['status'], r['value'],
+                         '{:.4f}'.format(r['time'])])
+    sols = dict((r['name'], r['solution']) for r in results
+                if r['solution'] is not None)
+    np.savez_compressed(path.rsplit('.', 1)[0] + '_solutions.npz', **sols)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Solves a list of scenarios on top of the same forms.')
+    parser.add_argument('scenarios', help='JSON file with a list of '
+                        'scenario dicts, see apply_scenario')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of workers, one per core by default')
+    parser.add_argument('--snapshot', default=None, help='Instance snapshot '
+                        '(see src.snapshot) to use instead of the forms of '
+                        'the data folder')
+    args = parser.parse_args(argv[1:])
+
+    root_dir = dirname(dirname(abspath(__file__)))
+    with open(args.scenarios, 'r') as f:
+        scenarios = json.load(f)
+    if args.snapshot is not None:
+        optim_params = load_snapshot(args.snapshot)[0]
+    else:
+        optim_params = read_forms(root_dir)[0]
+    results = run_batch(optim_params, scenarios, args.processes,
+                        cache_root=root_dir)
+    if not isdir(join(root_dir, 'solutions')):
+        makedirs(join(root_dir, 'solutions'))
+    write_results(join(root_dir, 'solutions', 'batch_results.csv'), results)
+    for r in results:
+        print(r['name'], r['status'], r['value'], '{:.3f}s'.format(r['time']))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
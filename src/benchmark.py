@@ -0,0 +1,228 @@
+import sys
+import json
+import resource
+import argparse
+import platform
+import subprocess
+import time
+from os.path import dirname, abspath
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+# (n_p, n_d, n_s) swept by default, from a month of a small team up to a
+# year of a big one
+DEFAULT_SIZES = [(64, 4, 6), (256, 13, 6), (512, 52, 6), (1024, 104, 6),
+                 (2048, 208, 8), (4096, 364, 8)]
+
+
+def generate_instance(n_p, n_d, n_s, seed=0, p_men=0.3, p_teacher=0.3,
+                      p_mature=0.4, slot_density=0.8, indisp_density=0.05,
+                      demand_pattern=None, load=0.5, n_forced=0):
+    """Generates a random instance with the given attribute distributions.
+
+    Args:
+        n_p (int): the number of people in the list
+        n_d (int): the number of days being considered
+        n_s (int): the number of slots of work per day
+        seed (int): Seed of the random generator
+        p_men (float): Probability of each person being a man
+        p_teacher (float): Probability of each person being a teacher
+        p_mature (float): Probability of each person being mature
+        slot_density (float): Probability of each person accepting each slot
+        indisp_density (float): Probability of each person being
+        indisponible on each day
+        demand_pattern (ndarray): The (n_s) demand of one day, repeated every
+        day. If None a pattern of 1 to 4 people per slot is drawn and scaled
+        so that a day needs at most load*n_p people
+        load (float): Maximum fraction of the people needed each day
+        n_forced (int): Number of forced (person, day*n_s+slot) entries,
+        drawn among the available cells
+
+    Returns:
+        tuple: The optim_params (n_p, n_d, n_s, G, T, M, indisp, forced,
+        slot_choice, demand), as returned by read_forms
+    """
+    rng = np.random.RandomState(seed)
+    G = np.int8(rng.rand(n_p) < p_men)
+    T = np.int8(rng.rand(n_p) < p_teacher)
+    M = np.int8(rng.rand(n_p) < p_mature)
+    slot_choice = np.int8(rng.rand(n_p, n_s) < slot_density)
+    indisp = [tuple(e) for e in
+              np.argwhere(rng.rand(n_p, n_d) < indisp_density).tolist()]
+    if demand_pattern is None:
+        demand_pattern = rng.randint(1, 5, size=n_s)
+        scale = load*n_p / float(demand_pattern.sum())
+        if scale < 1:
+            demand_pattern = np.maximum(1, np.floor(demand_pattern*scale))
+    demand = np.tile(np.asarray(demand_pattern, dtype=np.int64), n_d)
+
+    forced = []
+    if n_forced > 0:
+        avail = np.tile(slot_choice, (1, n_d)).astype(bool)
+        for p, d in indisp:
+            avail[p, d*n_s:(d+1)*n_s] = False
+        cells = np.argwhere(avail)
+        pick = cells[rng.choice(len(cells), min(n_forced, len(cells)),
+                                replace=False)]
+        # At most one forced slot per person and day
+        seen = set()
+        for p, j in pick.tolist():
+            if (p, j // n_s) not in seen:
+                seen.add((p, j // n_s))
+                forced.append((p, j))
+
+    return (n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand)
+
+
+# Modules that the light commands of main.py must not load
+HEAVY_MODULES = ['cvxpy', 'scipy.optimize']
+# Commands of main.py timed by startup_times
+STARTUP_COMMANDS = [['--help'], ['check-forms']]
+
+# Runs one command of main.py and prints, as its last line, the time spent
+# in this interpreter and the heavy modules that were loaded
+STARTUP_CODE = '''import sys, time, json
+start = time.time()
+sys.argv = ['main.py'] + {args!r}
+import main
+try:
+    main.main(sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps({{'time': time.time() - start,
+                  'modules': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def startup_times(commands=None, repeat=5):
+    """Times the commands of main.py, each in a fresh interpreter.
+
+    Returns:
+        list: One record per command with the median wall time (interpreter
+        start included), the median time after the interpreter start and
+        the heavy modules it loaded
+    """
+    root_dir = dirname(dirname(abspath(__file__)))
+    records = []
+    for args in commands or STARTUP_COMMANDS:
+        code = STARTUP_CODE.format(args=list(args), heavy=HEAVY_MODULES)
+        walls, inner = [], []
+        for k in range(repeat):
+            start = time.time()
+            out = subprocess.check_output([sys.executable, '-c', code],
+                                          cwd=root_dir)
+            walls.append(time.time() - start)
+            last = json.loads(out.decode().strip().splitlines()[-1])
+            inner.append(last['time'])
+        records.append({'command': ' '.join(args),
+                        'wall_time': float(np.median(walls)),
+                        'import_and_run_time': float(np.median(inner)),
+                        'heavy_modules': last['modules']})
+    return records
+
+
+def run_case(args):
+    """Builds and solves one instance. Meant to run in its own process, so
+    the peak memory (max resident set size) is the one of this case only.
+    """
+    size, seed, backend, gen_options = args
+    from src.optim import solve, SolveStats
+    n_p, n_d, n_s = size
+    params = generate_instance(n_p, n_d, n_s, seed=seed, **gen_options)
+
+    stats = SolveStats()
+    status, sol, value = solve(*params, backend=backend, stats=stats)
+    build_time = stats.timings['build'] + stats.timings['canonicalization']
+    solve_time = stats.timings['solver'] + stats.timings['postprocess']
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        peak = peak / 1024.
+    return {'n_p': n_p, 'n_d': n_d, 'n_s': n_s, 'seed': seed,
+            'backend': backend, 'status': status, 'objective': value,
+            'build_time': build_time, 'solve_time': solve_time,
+            'peak_memory_mb': peak / 1024., 'stats': stats.to_dict()}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=dirname(dirname(abspath(__file__))),
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes=None, backends=('highs',), seeds=(0,),
+                  gen_options=None):
+    """Runs every (size, backend, seed) combination, each in a fresh process.
+
+    Returns:
+        dict: The commit, the generator options and one record per run with
+        status, objective, build time, solve time and peak memory
+    """
+    sizes = sizes or DEFAULT_SIZES
+    gen_options = gen_options or {}
+    records = []
+    for size in sizes:
+        for backend in backends:
+            for seed in seeds:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    rec = pool.submit(run_case, (tuple(size), seed, backend,
+                                                 gen_options)).result()
+                print('{n_p}x{n_d}x{n_s} {backend} seed {seed}: {status} '
+                      '{objective}, build {build_time:.3f}s, solve '
+                      '{solve_time:.3f}s, {peak_memory_mb:.0f}MB'.format(**rec))
+                records.append(rec)
+    return {'commit': git_commit(), 'generator': gen_options,
+            'results': records}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Times the solver on seeded synthetic instances.')
+    parser.add_argument('--sizes', nargs='+', default=None,
+                        help='Instance sizes as n_p,n_d,n_s')
+    parser.add_argument('--backends', nargs='+', default=['highs'])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--slot-density', type=float, default=0.8)
+    parser.add_argument('--indisp-density', type=float, default=0.05)
+    parser.add_argument('--load', type=float, default=0.5)
+    parser.add_argument('--out', default='benchmark.json',
+                        help='Where to write the JSON results')
+    parser.add_argument('--startup', action='store_true',
+                        help='Times the startup of the light commands of '
+                        'main.py instead of the solver')
+    parser.add_argument('--max-startup', type=float, default=None,
+                        help='With --startup, fails if a command takes '
+                        'longer than this many seconds')
+    args = parser.parse_args(argv[1:])
+
+    if args.startup:
+        records = startup_times()
+        failed = False
+        for rec in records:
+            print('{command}: {wall_time:.3f}s, heavy modules: '
+                  '{heavy_modules}'.format(**rec))
+            failed |= len(rec['heavy_modules']) > 0
+            failed |= (args.max_startup is not None
+                       and rec['wall_time'] > args.max_startup)
+        with open(args.out, 'w') as f:
+            json.dump({'commit': git_commit(), 'startup': records}, f,
+                      indent=2)
+        return 1 if failed else 0
+
+    sizes = None
+    if args.sizes is not None:
+        sizes = [tuple(int(v) for v in s.split(',')) for s in args.sizes]
+    gen_options = {'slot_density': args.slot_density,
+                   'indisp_density': args.indisp_density, 'load': args.load}
+    report = run_benchmark(sizes, args.backends, args.seeds, gen_options)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,150 @@
+import os
+import hashlib
+from os.path import join, isdir
+import numpy as np
+from src.tests import Violation
+
+
+# Statuses of failed solver runs, which may succeed on the next try
+ERROR_STATUSES = ('solver_error', 'error')
+
+
+def hash_value(h, value):
+    """Feeds one value to the hash h. Arrays go in by dtype, shape and
+    bytes, since their repr elides the middle of large arrays.
+    """
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        h.update('{}{}'.format(value.dtype.str, value.shape).encode())
+        h.update(value.tobytes())
+    elif isinstance(value, dict):
+        h.update(b'{')
+        for k in sorted(value):
+            h.update(repr(k).encode())
+            hash_value(h, value[k])
+        h.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        h.update(b'[')
+        for v in value:
+            hash_value(h, v)
+        h.update(b']')
+    else:
+        h.update(repr(value).encode())
+    h.update(b'|')
+
+
+def hash_params(optim_params, prop=0.5, options=None):
+    """Content hash of the optimization parameters returned by read_forms,
+    together with prop and the solver options given to solve.
+
+    The indisp and forced lists are sorted first, so the same set of
+    entries always gives the same key.
+
+    Returns:
+        str: The hex digest used as cache key
+    """
+    h = hashlib.sha256()
+    for param in optim_params:
+        if isinstance(param, list):
+            param = np.asarray(sorted((int(a), int(b)) for a, b in param),
+                               dtype=np.int64).reshape(-1, 2)
+        hash_value(h, param)
+    h.update(repr(float(prop)).encode())
+    hash_value(h, options or {})
+    return h.hexdigest()
+
+
+class SolutionCache(object):
+    """On disk cache of solved instances, keyed by hash_params.
+
+    Every entry is a .npz file in root_dir/cache. The cache keeps at most
+    max_entries of them, evicting the least recently used ones, and the
+    recency is the modification time of the file, which is refreshed on
+    every hit. The CLI and the batch runner share it by pointing at the
+    same root_dir.
+    """
+
+    def __init__(self, root_dir, max_entries=256):
+        self.cache_dir = join(root_dir, 'cache')
+        self.max_entries = max_entries
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError:
+            # Another process of the same batch may have just created it
+            if not isdir(self.cache_dir):
+                raise
+
+    def path(self, key):
+        return join(self.cache_dir, key + '.npz')
+
+    def get(self, key):
+        """Returns the stored (status, solution, value, conflicts), or None
+        on a miss. conflicts is the precheck report of the solve.
+        """
+        try:
+            with np.load(self.path(key)) as data:
+                status = str(data['status'])
+                sol = data['sol'] if 'sol' in data else None
+                value = int(data['value']) if 'value' in data else None
+                conflicts = []
+                if 'rules' in data:
+                    for rule, cells in zip(data['rules'], data['cells']):
+                        cells = [None if c < 0 else int(c) for c in cells]
+                        conflicts.append(Violation(str(rule), *cells))
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        os.utime(self.path(key), None)
+        return status, sol, value, conflicts
+
+    def put(self, key, status, sol, value, conflicts=()):
+        entry = {'status': np.asarray(status)}
+        if sol is not None:
+            entry['sol'] = np.asarray(sol, dtype=np.int8)
+            entry['value'] = np.asarray(value)
+        if len(conflicts) > 0:
+            # The None person or slot of a Violation is stored as -1
+            entry['rules'] = np.asarray([v.rule for v in conflicts])
+            entry['cells'] = np.asarray(
+                [[-1 if c is None else c for c in v[1:]] for v in conflicts],
+                dtype=np.int64)
+        # Written aside and then moved, so readers never see half a file
+        tmp = join(self.cache_dir, '{}.{}.tmp.npz'.format(key, os.getpid()))
+        np.savez(tmp, **entry)
+        os.replace(tmp, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = [join(self.cache_dir, f) for f in os.listdir(self.cache_dir)
+                   if f.endswith('.npz') and '.tmp.' not in f]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for f in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def solve(self, optim_params, prop=0.5, stats=None, **options):
+        """Same as src.optim.solve, but taking the optim_params tuple of
+        read_forms and returning the stored result when there is one. On a
+        hit the backend of stats is set to 'cache' and its conflicts are
+        the stored ones. Failed solver runs are not stored.
+        """
+        key = hash_params(optim_params, prop, options)
+        hit = self.get(key)
+        if hit is not None:
+            status, sol, value, conflicts = hit
+            if stats is not None:
+                stats.backend = 'cache'
+                stats.conflicts = conflicts
+                stats.done(status, sol, value)
+            return status, sol, value
+        from src.optim import solve, SolveStats
+        if stats is None:
+            stats = SolveStats()
+        status, sol, value = solve(*optim_params, prop=prop, stats=stats,
+                                   **options)
+        if not status.startswith(ERROR_STATUSES):
+            self.put(key, status, sol, value, stats.conflicts)
+        return status, sol, value
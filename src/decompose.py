@@ -0,0 +1,274 @@
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from src.optim import run_presolve
+from src.milp import (build_milp, run_milp, milp_options, workload,
+                      workload_bound)
+from src.heuristic import solve_heuristic
+from src.repair import repair
+
+
+def day_instance(n_p, n_d, n_s, indisp, forced, demand, d):
+    """Extracts the indisp, forced and demand of day d as a one day instance.
+    """
+    day_indisp = [(p, 0) for p, dd in indisp if dd == d]
+    day_forced = [(p, j - d*n_s) for p, j in forced if j // n_s == d]
+    day_demand = np.asarray(demand).reshape(-1)[d*n_s:(d+1)*n_s]
+    return day_indisp, day_forced, day_demand
+
+
+def solve_day(args):
+    """Solves the one day subproblem, taking the people with the smallest
+    prices. The people that are not allowed on the day are left out.
+
+    Args:
+        args (tuple): (n_p, n_s, G, T, M, indisp, forced, slot_choice, demand,
+        prop, price, blocked), with the indisp, forced and demand of the day
+
+    Returns:
+        ndarray: The (n_p, n_s) assignment of the day, or None if infeasible
+    """
+    (n_p, n_s, G, T, M, indisp, forced, slot_choice, demand, prop, price,
+     blocked) = args
+    slot_choice = np.array(slot_choice)
+    slot_choice[blocked] = 0
+    c, A, a_lo, a_hi, lb, ub, integrality = build_milp(
+        n_p, 1, n_s, G, T, M, indisp, forced, slot_choice, demand, prop)
+    c[:-1] = np.repeat(price, n_s)
+    c[-1] = 0
+    status, x, res = run_milp(c, A, a_lo, a_hi, lb, ub, integrality)
+    if x is None:
+        return None
+    return np.int8(x[:-1].round().reshape(n_p, n_s))
+
+
+def solve_days(tasks, pool):
+    if pool is None:
+        return [solve_day(t) for t in tasks]
+    return list(pool.map(solve_day, tasks))
+
+
+def coordinate(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+               prop, W, pool, hist=None, pre=None, start=None, max_iter=50,
+               patience=5, n_subs=3):
+    """Looks for a schedule with a maximum workload of W by re-solving days
+    independently, starting from the schedule start.
+
+    Each round, every person above W leaves as many of their days as they
+    are over, the days with the most substitutes first, and the days they
+    leave are re-solved in parallel. A substitute is someone free for the
+    same slot and not working that day, and up to n_subs of them are let in
+    per dropped slot, each one at most as many times as their budget left
+    (W minus their workload). So no one goes over W, and the total excess
+    over W never grows. The people already working a day cost nothing there
+    and the others cost more the higher their workload, so the days change
+    as little as possible. A day that is infeasible without someone keeps
+    its assignment, and that day is tried last for them in the next rounds,
+    while n_subs doubles. After patience rounds without progress, the days
+    of the people still above W are repaired together with src.repair.
+
+    Returns:
+        sol (ndarray): A (n_p, n_d*n_s) schedule with workload at most W, or
+        None if none was found
+        proven (bool): Whether W is proven infeasible, because some day is
+        infeasible even with everyone whose forced slots and past workload
+        leave them room under W
+    """
+    if pre is None:
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+    days = [day_instance(n_p, n_d, n_s, indisp, forced, demand, d)
+            for d in range(n_d)]
+    past = np.zeros(n_p) if hist is None else np.asarray(hist)
+    T = np.asarray(T).reshape(-1)
+    multi = np.asarray(demand).reshape(n_d, n_s) > 1
+    free = pre.free.reshape(n_p, n_d, n_s)
+    forced_day = (pre.fixed.reshape(n_p, n_d, n_s) == 1).any(axis=2).T
+
+    def task(d, allowed, price):
+        ind, frc, dem = days[d]
+        return (n_p, n_s, G, T, M, ind, frc, slot_choice, dem, prop, price,
+                ~allowed)
+
+    # The people that reach W with their forced slots alone only work those
+    full = pre.fixed.sum(axis=1) + past >= W
+    base = np.tile(~full, (n_d, 1)) | forced_day
+    if full.any() or start is None:
+        blocks = solve_days([task(d, base[d], 1 + past) for d in range(n_d)],
+                            pool)
+        if any(b is None for b in blocks):
+            return None, True
+        if start is None:
+            start = np.concatenate(blocks, axis=1)
+
+    work = np.int8(start).reshape(n_p, n_d, n_s).copy()
+    tried = np.zeros((n_d, n_p), dtype=bool)
+    rng = np.random.RandomState(0)
+    best_excess, stall = None, 0
+    for it in range(max_iter):
+        worked = work.any(axis=2)
+        load = worked.sum(axis=1) + past
+        excess = int(np.clip(load - W, 0, None).sum())
+        if excess == 0:
+            return work.reshape(n_p, n_d*n_s), False
+        if best_excess is not None and excess >= best_excess:
+            # Lets more substitutes in while it makes no progress
+            stall += 1
+            n_subs *= 2
+            if stall >= patience:
+                break
+        else:
+            best_excess, stall = excess, 0
+
+        spare = np.clip(W - load, 0, None)
+        drop = np.zeros((n_d, n_p), dtype=bool)
+        new = np.zeros((n_d, n_p), dtype=bool)
+        for p in np.flatnonzero(load > W):
+            cand = np.flatnonzero(worked[p] & ~forced_day[:, p])
+            if len(cand) == 0:
+                continue
+            slots = work[p, cand].argmax(axis=1)
+            # Substitutes of p: allowed, free for the same slot, not working
+            # that day, and teachers for a teacher
+            subs = base[cand] & ~worked.T[cand] & free[:, cand, slots].T
+            subs[multi[cand, slots]] &= T == T[p]
+            score = (subs & (spare > 0)).sum(axis=1) - n_p*tried[cand, p]
+            left = int(load[p] - W)
+            for k in np.argsort(-score, kind='stable'):
+                # Only the substitutes with budget left may come in, each
+                # one taking one day of it
+                q = np.flatnonzero(subs[k] & (spare > 0) & ~new[cand[k]])
+                if left == 0 or len(q) == 0:
+                    continue
+                q = q[np.argsort(-spare[q], kind='stable')[:n_subs]]
+                drop[cand[k], p] = True
+                new[cand[k], q] = True
+                spare[q] -= 1
+                left -= 1
+
+        S = rng.permutation(np.flatnonzero(drop.any(axis=1)))
+        if len(S) == 0:
+            break
+        allowed = (worked.T[S] & ~drop[S]) | new[S] | forced_day[S]
+        price = np.where(worked.T[S], 0, 1 + load - load.min())
+        blocks = solve_days([task(d, allowed[i], price[i])
+                             for i, d in enumerate(S)], pool)
+        for i, d in enumerate(S):
+            if blocks[i] is None:
+                tried[d] |= drop[d]
+            else:
+                work[:, d] = blocks[i]
+
+    # The excess left needs chains of moves that the days can't see one by
+    # one. The days of the people still above W are reopened together, the
+    # rest of the schedule is kept (see src.repair), as long as that and
+    # its widening stay within half of the days
+    worked = work.any(axis=2)
+    over = worked.sum(axis=1) + past > W
+    reopen = np.flatnonzero((worked[over] & ~forced_day[:, over].T).any(
+        axis=0))
+    if len(reopen) > n_d // 2:
+        return None, False
+    sol = repair((n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                  demand), work.reshape(n_p, n_d*n_s), prop=prop, hist=hist,
+                 max_workload=W, n_substitutes=None, days=list(reopen),
+                 max_days=n_d // 2)[1]
+    return sol, False
+
+
+def solve_bisection(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                    demand, prop=0.5, hist=None, processes=None, exact=True,
+                    time_limit=None, mip_gap=None, pre=None):
+    """Solves the scheduling problem by bisection on the workload cap W,
+    checking each W with independent per-day subproblems solved in a process
+    pool (see coordinate).
+
+    The bisection starts from the schedule of src.heuristic. A cap that the
+    per-day checks meet is feasible, and one for which some day is
+    infeasible even with everyone that has budget left is infeasible. If
+    they fail without a proof for some cap, one exact MILP restricted to
+    the remaining workload range settles the optimum, unless exact is
+    False.
+
+    Args:
+        Same as src.optim.solve
+        processes (int): Number of worker processes, None for one per core
+        and 0 to solve the days in this process
+        exact (bool): Whether to close the remaining gap with the exact MILP
+        time_limit (float): Wall-clock budget in seconds. The bisection stops
+        when it runs out, and the exact MILP gets what is left
+        mip_gap (float): Relative gap of the exact MILP
+        pre (Presolved): The result of run_presolve, if already known
+
+    Returns:
+        Same as src.optim.solve, (status, solution, value)
+    """
+    start = time.time()
+    if pre is None:
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+    if len(pre.conflicts) > 0:
+        return 'infeasible', None, None
+
+    past = np.zeros(n_p) if hist is None else np.asarray(hist)
+    lo = workload_bound(n_p, demand, hist, pre.fixed)
+    best = solve_heuristic(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop, hist, pre=pre)[1]
+    if best is not None and workload(best, hist) <= lo:
+        return 'optimal', best, lo
+    pool = None
+    if processes != 0 and n_d > 1:
+        pool = ProcessPoolExecutor(max_workers=processes)
+    try:
+        if best is None:
+            # Every day is feasible on its own iff the instance is feasible
+            # for W = n_d, since no one can work more than once a day.
+            best = coordinate(n_p, n_d, n_s, G, T, M, indisp, forced,
+                              slot_choice, demand, prop, n_d + past.max(),
+                              pool, hist, pre)[0]
+            if best is None:
+                return 'infeasible', None, None
+        hi = int(workload(best, hist))
+        failed = False
+        out_of_time = False
+        while lo < hi:
+            if time_limit is not None and time.time() - start > time_limit:
+                out_of_time = True
+                break
+            mid = (lo + hi) // 2
+            sol, proven = coordinate(n_p, n_d, n_s, G, T, M, indisp, forced,
+                                     slot_choice, demand, prop, mid, pool,
+                                     hist, pre, start=best)
+            if sol is not None:
+                best = sol
+                hi = int(workload(sol, hist))
+            elif proven:
+                lo = mid + 1
+            else:
+                failed = True
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if lo >= hi or not (failed or out_of_time):
+        return 'optimal', best, hi
+    left = None
+    if time_limit is not None:
+        left = time_limit - (time.time() - start)
+    if not exact or (left is not None and left <= 0):
+        return 'optimal_inaccurate', best, hi
+
+    # Settles the optimum within [lo, hi - 1], or proves that hi is optimal
+    c, A, a_lo, a_hi, lb, ub, integrality = build_milp(
+        n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand, prop,
+        hist)
+    lb[-1], ub[-1] = lo, hi - 1
+    status, x, res = run_milp(c, A, a_lo, a_hi, lb, ub, integrality, pre=pre,
+                              options=milp_options(left, mip_gap))
+    if x is None:
+        if status == 'infeasible':
+            return 'optimal', best, hi
+        return 'optimal_inaccurate', best, hi
+    return status, np.int8(x[:-1].round().reshape(n_p, n_d*n_s)), \
+        int(round(x[-1]))
@@ -1,8 +1,11 @@
 import sys
-from os.path import abspath, join, dirname, isfile
+from os import makedirs
+from os.path import abspath, join, dirname, isfile, isdir
 import csv
+import json
 import numpy as np
 import datetime
+from importlib.util import find_spec
 
 
 # TODO pass the root path as parameter to everyone
@@ -48,102 +51,103 @@ def generate_forms(root_dir):
         pass
 
 
+# Accepted contents of the categorical columns of info.csv and ficha_servo.csv
+G_DICT = {'M':1,'m':1,'masc':1,'homem':1, 'F':0, 'f':0, 'fem':0,
+          'mulher':0, "1":1, '0':0}
+YES_NO_DICT = {'Sim':1, 'S':1, 's':1, 'Y':1, 'y':1, "Não":0, "N":0,
+               'n':0, "":0}
+# The slot choice keeps the three levels, 2 marks the preferred slots, which
+# are used by the lexicographic objective (see ScheduleModel)
+SLOT_DICT = {'N Aceito':0, 'Aceito':1, 'Gosto':2}
+
+
+def read_csv(path):
+    """Reads a whole csv form at once.
+
+    Returns:
+        headers (list): The first row
+        rows (list): The other rows
+    """
+    with open(path, 'r') as datafile:
+        data_reader = csv.reader(datafile, delimiter=',')
+        headers = next(data_reader)
+        rows = list(data_reader)
+    return headers, rows
+
+
 def read_forms(root_dir):
-    # Checks the names are in the same order in all files
-    if check_order_forms(root_dir):
-        # INFO
-        with open(join(root_dir, 'data', 'info.csv'), 'r') as datafile:
-            data_reader = csv.reader(datafile, delimiter=',')
-            names = []
-            G = []
-            G_dict = {'M':1,'m':1,'masc':1,'homem':1, 'F':0, 'f':0, 'fem':0,
-                      'mulher':0, "1":1, '0':0}
-            T = []
-            T_dict = {'Sim':1, 'S':1, 's':1, 'Y':1, 'y':1, "Não":0, "N":0,
-                      'n':0, "":0}
-            K = []
-            K_dict = {'Sim':1, 'S':1, 's':1, 'Y':1, 'y':1, "Não":0, "N":0,
-                      'n':0, "":0}
-            headers = next(data_reader)
-            # TODO check the headers
-            for i, row in enumerate(data_reader):
-                # Yes, I'm very lazy...
-                names.append(row[0])
-                try:
-                    G.append(G_dict[row[1]])
-                except KeyError:
-                    raise KeyError('O conteudo "{}" na linha {}, coluna'
-                    ' genero  não é permitido. Na coluna de genero use'
-                    ' apenas "M" ou "F".'.format(row[1], i+2))
-                try:
-                    T.append(T_dict[row[2]])
-                except KeyError:
-                    raise KeyError('O conteudo "{}" na linha {}, coluna'
-                    ' professor  não é permitido. Na coluna de professor'
-                    ' use apenas "S" ou "N".'.format(row[2], i+2))
-                try:
-                    K.append(K_dict[row[3]])
-                except KeyError:
-                    raise KeyError('O conteudo "{}" na linha {}, coluna'
-                    ' HasKids  não é permitido. Na coluna HasKids'
-                    ' use apenas "S" ou "N".'.format(row[3], i+2))
-            G = np.asarray(G, dtype=np.int8)
-            T = np.asarray(T, dtype=np.int8)
-            K = np.asarray(K, dtype=np.int8)
-            n_p = len(names)
-
-        # Indisp Alloc
-        with open(join(root_dir, 'data', 'indisp_alloc.csv'), 'r') as datafile:
-            data_reader = csv.reader(datafile, delimiter=',')
-            indisp = []
-            headers = next(data_reader)
-            days = headers[1:]
-            n_d = len(headers) - 1
-
-            for i, row in enumerate(data_reader):
-                for j in range(n_d):
-                    # I'm using the empty string
-                    if row[j+1] != '':
-                        indisp.append((np.int8(i), np.int8(j)))
-
-        # Ficha Servo
-        with open(join(root_dir, 'data', 'ficha_servo.csv'), 'r') as datafile:
-            data_reader = csv.reader(datafile, delimiter=',')
-            # TODO extend to 3 level values, to use in new objective
-            slot_dict = {'N Aceito':0, 'Aceito':1, 'Gosto':1}
-            headers = next(data_reader)
-            n_s = len(headers) - 1
-            slot_choice = np.zeros([n_p, n_s])
-            
-            for i, row in enumerate(data_reader):
-                for j in range(n_s):
-                    try:
-                        slot_choice[i, j] = slot_dict[row[j+1]]
-                    except KeyError:
-                        raise KeyError('O conteudo "{}" na linha {}, coluna'
-                        ' {} não é permitido, os únicos permitidos são: ["N'
-                        ' aceito", "Aceito", "Gosto"].'
-                        .format(row[j+1], i+2, j+2))
-            slot_choice = np.int8(slot_choice)
-        
-        # Personnel
-        with open(join(root_dir, 'data', 'personnel.csv'), 'r') as datafile:
-            data_reader = csv.reader(datafile, delimiter=',')
-            header = next(data_reader)
-            slot_names = header[1:]
-            demand = []
-            for row in data_reader:
-                demand = demand + [int(i) for i in row[1:]]
-            demand = np.asarray(demand, dtype=np.int8)
-            # if len(demand) == n_s:
-            #     demand = np.asarray(demand)
-            # else:
-            #     raise Exception("Você deve completar a demanda de pessoal para"
-            #     " todas as {} atividades".format(n_s))
-
-    # Order the forms if possible
-    else:
-        raise Exception("Not Implemented Yet")
+    """Reads the four forms of the data folder, each one exactly once. The
+    rows of ficha_servo.csv and indisp_alloc.csv are matched to the people of
+    info.csv by name, so they can be in any order (see order_forms).
+
+    Returns:
+        optim_params (tuple): (n_p, n_d, n_s, G, T, K, indisp, forced,
+        slot_choice, demand), the parameters of src.optim.solve
+        names (list): The names of the people, in the order of info.csv
+        slot_names (list): The names of the slots
+        days (list): The names of the days
+    """
+    # INFO
+    headers, rows = read_csv(join(root_dir, 'data', 'info.csv'))
+    # TODO check the headers
+    n_p = len(rows)
+    names = [row[0] for row in rows]
+    G = np.empty(n_p, dtype=np.int8)
+    T = np.empty(n_p, dtype=np.int8)
+    K = np.empty(n_p, dtype=np.int8)
+    for i, row in enumerate(rows):
+        try:
+            G[i] = G_DICT[row[1]]
+        except KeyError:
+            raise KeyError('O conteudo "{}" na linha {}, coluna'
+            ' genero  não é permitido. Na coluna de genero use'
+            ' apenas "M" ou "F".'.format(row[1], i+2))
+        try:
+            T[i] = YES_NO_DICT[row[2]]
+        except KeyError:
+            raise KeyError('O conteudo "{}" na linha {}, coluna'
+            ' professor  não é permitido. Na coluna de professor'
+            ' use apenas "S" ou "N".'.format(row[2], i+2))
+        try:
+            K[i] = YES_NO_DICT[row[3]]
+        except KeyError:
+            raise KeyError('O conteudo "{}" na linha {}, coluna'
+            ' HasKids  não é permitido. Na coluna HasKids'
+            ' use apenas "S" ou "N".'.format(row[3], i+2))
+
+    # Indisp Alloc
+    headers, rows = read_csv(join(root_dir, 'data', 'indisp_alloc.csv'))
+    days = headers[1:]
+    n_d = len(headers) - 1
+    indisp = []
+    for i, row in order_forms(names, rows, 'indisp_alloc.csv'):
+        for j in range(n_d):
+            # I'm using the empty string
+            if row[j+1] != '':
+                indisp.append((i, j))
+    indisp.sort()
+
+    # Ficha Servo
+    headers, rows = read_csv(join(root_dir, 'data', 'ficha_servo.csv'))
+    n_s = len(headers) - 1
+    slot_choice = np.zeros([n_p, n_s], dtype=np.int8)
+    for k, (i, row) in enumerate(order_forms(names, rows, 'ficha_servo.csv')):
+        for j in range(n_s):
+            try:
+                slot_choice[i, j] = SLOT_DICT[row[j+1]]
+            except KeyError:
+                raise KeyError('O conteudo "{}" na linha {}, coluna'
+                ' {} não é permitido, os únicos permitidos são: ["N'
+                ' aceito", "Aceito", "Gosto"].'
+                .format(row[j+1], k+2, j+2))
+
+    # Personnel
+    demand, slot_names = read_demand(join(root_dir, 'data', 'personnel.csv'))
+    # if len(demand) == n_s:
+    #     demand = np.asarray(demand)
+    # else:
+    #     raise Exception("Você deve completar a demanda de pessoal para"
+    #     " todas as {} atividades".format(n_s))
 
     forced = []
     optim_params = (n_p, n_d, n_s, G, T, K, indisp, forced, slot_choice, demand)
@@ -151,65 +155,237 @@ def read_forms(root_dir):
     return optim_params, names, slot_names, days
 
 
-def order_forms():
-    pass
-
-
-def check_order_forms(root_dir):
-    file_list = []
-    # fail_cases = [] # List of the rows that don't match 
-    in_order = True
-    if isfile(join(root_dir, 'data', 'info.csv')):
-        file_list.append(join(root_dir, 'data', 'info.csv'))
-    if isfile(join(root_dir, 'data', 'ficha_servo.csv')):
-        file_list.append(join(root_dir, 'data', 'ficha_servo.csv'))
-    if isfile(join(root_dir, 'data', 'indisp_alloc.csv')):
-        file_list.append(join(root_dir, 'data', 'indisp_alloc.csv'))
-    
-    names_list = []
-    if len(file_list) > 1:
-        for file_ in file_list:
-            with open(file_, 'r') as datafile:
-                data_reader = csv.reader(datafile, delimiter=',')
-                names = []
-                for row in data_reader:
-                    names.append(row[0])
-                names_list.append(names)
-
-    # From here on I suppose that we have all of the 3 files, cause I'm tired
-    if len(names_list[0]) != len(names_list[1]) or len(names_list[1]) != len(names_list[2]):
-        in_order = False
-    else:
-        for k in range(len(names_list[0])):
-            if names_list[0][k] != names_list[1][k] or names_list[1][k] != names_list[2][k]:
-                in_order = False
+def read_demand(path):
+    """Reads a personnel.csv-like table of demand, one row per day and one
+    column per slot.
+
+    Returns:
+        demand (ndarray): The (n_d*n_s) demand vector
+        slot_names (list): The names of the slots
+    """
+    header, rows = read_csv(path)
+    slot_names = header[1:]
+    demand = np.empty([len(rows), len(slot_names)], dtype=np.int8)
+    for d, row in enumerate(rows):
+        demand[d] = [int(i) for i in row[1:]]
+    return demand.reshape(-1), slot_names
+
+
+def order_forms(names, rows, file_name):
+    """Matches the rows of a form to the people of info.csv by name, through
+    a dict from name to index. Repeated names are matched in order, the k-th
+    row with a name goes to the k-th person with that name in info.csv.
+
+    Args:
+        names (list): The names of the people, in the order of info.csv
+        rows (list): The rows of the form, with the name in the first column
+        file_name (str): The name of the form, for the error messages
+
+    Returns:
+        list: (index in names, row) pairs, in the order of the form
+    """
+    index = {}
+    for i, name in enumerate(names):
+        index.setdefault(name, []).append(i)
+    used = dict((name, 0) for name in index)
+    ordered = []
+    for k, row in enumerate(rows):
+        if row[0] not in index:
+            raise KeyError('O nome "{}" na linha {} de {} não está em'
+                           ' info.csv.'.format(row[0], k+2, file_name))
+        if used[row[0]] == len(index[row[0]]):
+            raise Exception('O nome "{}" aparece mais vezes em {} do que em'
+                            ' info.csv.'.format(row[0], file_name))
+        ordered.append((index[row[0]][used[row[0]]], row))
+        used[row[0]] += 1
+    missing = [name for name in index if used[name] < len(index[name])]
+    if len(missing) > 0:
+        raise Exception('Os nomes {} de info.csv não estão em {}.'
+                        .format(missing, file_name))
+    return ordered
+
+
+# File name suffix and extension of each output format of write_sol
+SOL_FORMATS = {'roster': '.csv', 'person': '_pessoas.csv', 'json': '.json',
+               'parquet': '.parquet'}
+
+
+def slot_index(sol):
+    """Inverted index of a solution, built once from np.nonzero.
+
+    Returns:
+        people (ndarray): The assigned people, grouped by column of sol
+        starts (ndarray): people[starts[j]:starts[j+1]] are the people
+        assigned to column j = day*n_s + slot
+    """
+    p_idx, j_idx = np.nonzero(sol)
+    order = np.lexsort((p_idx, j_idx))
+    starts = np.searchsorted(j_idx[order], np.arange(sol.shape[1] + 1))
+    return p_idx[order], starts
 
-    return in_order
+
+def sol_paths(out_dir, base_name, formats, if_exists):
+    """Chooses the output files. With if_exists='version' the first suffix
+    _1, _2, ... for which none of the files exist is used.
+    """
+    paths = dict((f, join(out_dir, base_name + SOL_FORMATS[f]))
+                 for f in formats)
+    if if_exists == 'version':
+        k = 0
+        while any(isfile(p) for p in paths.values()):
+            k += 1
+            paths = dict((f, join(out_dir, '{}_{}{}'.format(
+                base_name, k, SOL_FORMATS[f]))) for f in formats)
+    elif if_exists == 'skip':
+        paths = dict((f, p) for f, p in paths.items() if not isfile(p))
+    elif if_exists != 'overwrite':
+        raise ValueError('if_exists must be "version", "overwrite" or "skip".')
+    return paths
+
+
+def read_sol(path, names, slot_names, days):
+    """Reads back a solution from the json output of write_sol.
+
+    Returns:
+        ndarray: The (n_p, n_d*n_s) solution
+    """
+    with open(path, 'r') as json_file:
+        assignments = json.load(json_file)['assignments']
+    n_s = len(slot_names)
+    day_pos = dict((d, i) for i, d in enumerate(days))
+    slot_pos = dict((s, i) for i, s in enumerate(slot_names))
+    try:
+        cols = [day_pos[d]*n_s + slot_pos[s] for d, s in
+                zip(assignments['day'], assignments['slot'])]
+    except KeyError as e:
+        raise KeyError('O dia ou atividade {} de {} não está nos'
+                       ' formulários.'.format(e, path))
+    sol = np.zeros((len(names), len(days)*n_s), dtype=np.int8)
+    sol[np.asarray(assignments['person_index'], dtype=np.int64), cols] = 1
+    return sol
+
+
+# Explanation of each rule of src.optim.precheck
+CONFLICT_MSGS = {
+    'forced': '{name} foi forçado(a) num horário em que não está disponível',
+    'no_repeat': '{name} foi forçado(a) em mais de uma atividade no dia',
+    'demand': 'não há pessoas disponíveis suficientes para a demanda, ou'
+              ' há mais pessoas forçadas do que a demanda',
+    'day_demand': 'a demanda total do dia é maior que o número de pessoas'
+                  ' disponíveis no dia',
+    'gender': 'não é possível respeitar o limite de homens, faltam mulheres'
+              ' disponíveis ou há homens forçados demais',
+    'teacher': 'não é possível ter exatamente um professor, nenhum está'
+               ' disponível, há mais de um forçado ou faltam auxiliares',
+    'maturity': 'não há nenhuma pessoa madura disponível'}
+
+
+def explain_conflicts(report, names, slot_names, days):
+    """Describes the failed pre-checks of src.optim.precheck, one line per
+    (day, slot, rule).
+
+    Returns:
+        list: The messages, in the order of the report
+    """
+    lines = []
+    for rule, person, day, slot in report:
+        where = days[day] if slot is None else '{}, {}'.format(
+            days[day], slot_names[slot])
+        name = '' if person is None else names[person]
+        lines.append('{}: {}.'.format(where, CONFLICT_MSGS[rule].format(
+            name=name)))
+    return lines
+
+
+def check_formats(formats):
+    """Raises an ImportError if some output format of write_sol needs a
+    package that is not installed, so nothing is written.
+    """
+    if 'parquet' in formats and find_spec('pyarrow') is None:
+        raise ImportError('The parquet output needs pyarrow, install it'
+                          ' with "pip install pyarrow".')
 
 
 # TODO maybe give the user the option of choosing where to save the solution
-def write_sol(root_dir, sol, names, slot_names, days, statistics=None):
+def write_sol(root_dir, sol, names, slot_names, days, statistics=None,
+              formats=('roster',), if_exists='version',
+              base_name='ListaSAPI_solved'):
+    """Writes the solution in the solutions folder.
+
+    Args:
+        root_dir (str): The root of the project
+        sol (ndarray): The (n_p, n_d*n_s) solution
+        names (list): The names of the people
+        slot_names (list): The names of the slots
+        days (list): The names of the days
+        statistics (SolveStats): If given, written in the stamp row after
+        the generation date (and as a field of the json output)
+        formats (tuple): Any of 'roster' (one row per slot and one column
+        per day), 'person' (one row per person and one column per day),
+        'json' and 'parquet' (one row per assignment, needs pyarrow)
+        if_exists (str): 'version' writes ListaSAPI_solved_1.csv and so on
+        when the file exists, 'overwrite' replaces it and 'skip' leaves it
+        base_name (str): The file name, without extension
+
+    Returns:
+        dict: The path written for each format
+    """
+    check_formats(formats)
     now = datetime.datetime.now()
-    if not isfile(join(root_dir, 'solutions', 'ListaSAPI_solved.csv')):
-        with open(join(root_dir, 'solutions', 'ListaSAPI_solved.csv'), 'w') as csv_file:
+    n_d, n_s = len(days), len(slot_names)
+    out_dir = join(root_dir, 'solutions')
+    if not isdir(out_dir):
+        makedirs(out_dir)
+    paths = sol_paths(out_dir, base_name, formats, if_exists)
+    stamp = ['Generated the {}'.format(now)]
+    if statistics is not None:
+        stamp += statistics.stamp()
+    names = np.asarray(names, dtype=object)
+    people, starts = slot_index(sol)
+
+    if 'roster' in paths:
+        with open(paths['roster'], 'w') as csv_file:
             wr = csv.writer(csv_file, dialect='excel')
-            stamp = ['Generated the {}'.format(now)]
             wr.writerow(stamp)
             header = ['Papel'] + days
             wr.writerow(header)
-            for s, slot_name in enumerate(slot_names):
-                row = [slot_name]
-                for d, day_name in enumerate(days):
-                    allocated_peeps = []
-                    for p, p_name in enumerate(names):
-                        if sol[p, d+s] == 1:
-                            allocated_peeps.append(p_name)
-                    row.append(', '.join(allocated_peeps))
-                wr.writerow(row)
+            wr.writerows([slot_name] + [
+                ', '.join(names[people[starts[j]:starts[j+1]]])
+                for j in range(s, n_d*n_s, n_s)]
+                for s, slot_name in enumerate(slot_names))
 
-    else:
-        # TODO ask if the user wants to overwrite
-        pass
+    if 'person' in paths:
+        # The slot of each person on each day, '' when off
+        Xd = np.asarray(sol).reshape(-1, n_d, n_s)
+        cells = np.asarray(list(slot_names) + [''], dtype=object)[
+            np.where(Xd.any(axis=2), Xd.argmax(axis=2), n_s)]
+        total = Xd.sum(axis=(1, 2))
+        with open(paths['person'], 'w') as csv_file:
+            wr = csv.writer(csv_file, dialect='excel')
+            wr.writerow(stamp)
+            wr.writerow(['Nome', 'Total'] + days)
+            wr.writerows([name, total[p]] + cells[p].tolist()
+                         for p, name in enumerate(names))
+
+    if 'json' in paths or 'parquet' in paths:
+        # One entry per assignment, already sorted by column
+        cols = np.repeat(np.arange(n_d*n_s), np.diff(starts))
+        columns = {'person': names[people].tolist(),
+                   'person_index': people.tolist(),
+                   'day': [days[j // n_s] for j in cols],
+                   'slot': [slot_names[j % n_s] for j in cols]}
+    if 'json' in paths:
+        out = {'generated': str(now), 'days': days, 'slots': slot_names,
+               'statistics': statistics.to_dict() if statistics else None,
+               'assignments': columns}
+        with open(paths['json'], 'w') as json_file:
+            json.dump(out, json_file)
+    if 'parquet' in paths:
+        import pyarrow
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(pyarrow.table(columns), paths['parquet'])
+
+    return paths
 
 
 # def main():
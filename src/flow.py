@@ -0,0 +1,190 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import maximum_flow
+from src.optim import run_presolve
+from src.milp import workload_bound
+from src.tests import validate
+
+
+def flow_applies(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+                 prop=0.5, pre=None):
+    """Whether the instance is a transportation problem, i.e. whether the
+    gender, teacher and maturity rules are all capacities of a flow network.
+
+    This is the case when no slot has a demand above one (the rules only
+    apply to those slots), or when prop is 1 (no gender cap) and every
+    teacher available for a slot with demand above one is mature. Then the
+    single teacher of the slot is a capacity of its own, and it is the
+    mature person the slot needs.
+
+    Args:
+        Same as src.optim.solve
+        pre (Presolved): The result of run_presolve, if already known
+    """
+    multi = np.asarray(demand).reshape(-1) > 1
+    if not multi.any():
+        return True
+    if prop < 1:
+        return False
+    if pre is None:
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+    avail = pre.free | (pre.fixed == 1)
+    immature = (np.asarray(T).reshape(-1) == 1) & \
+        (np.asarray(M).reshape(-1) == 0)
+    return not avail[np.ix_(immature, multi)].any()
+
+
+def flow_network(n_p, n_d, n_s, T, demand, pre):
+    """The flow network of the schedule: source -> person -> (person, day)
+    -> slot -> sink. The (person, day) nodes have capacity one (no repeat),
+    there is one edge per free cell, and the slots with demand above one
+    have a teacher node of capacity one and a node for the others. The
+    forced cells are taken out of the demand and of the days beforehand.
+
+    Returns:
+        rows, cols, caps (ndarray): The edges and their capacities. The first
+        n_p edges leave the source, their capacity is the workload cap
+        cells (ndarray): For each (person, day) -> slot edge, its cell of X,
+        in the same order as the edges that follow the (person, day) ones
+        n_nodes (int): Number of nodes, the source is 0 and the sink 1
+        need (int): The flow that fills every slot
+    """
+    N = n_d*n_s
+    demand = np.asarray(demand, dtype=np.int64).reshape(-1)
+    T = np.asarray(T, dtype=np.int64).reshape(-1)
+    multi = demand > 1
+    ones = pre.fixed == 1
+    n_teach = T.dot(ones)
+    persons = 2 + np.arange(n_p)
+    days = 2 + n_p + np.arange(n_p*n_d)
+    teach = 2 + n_p + n_p*n_d + np.arange(N)
+    others = teach + N
+
+    p, j = np.nonzero(pre.free)
+    to_teach = multi[j] & (T[p] == 1)
+    slot = np.where(to_teach, teach[j], others[j])
+    # The teacher node of a slot takes its single teacher, the other node
+    # the rest of the demand
+    cap_teach = np.where(multi, 1 - n_teach, 0)
+    cap_others = demand - ones.sum(axis=0) - cap_teach
+    rows = np.concatenate([np.zeros(n_p, dtype=np.int64),
+                           np.repeat(persons, n_d), days[p*n_d + j//n_s],
+                           teach, others])
+    cols = np.concatenate([persons, days, slot,
+                           np.ones(2*N, dtype=np.int64)])
+    caps = np.concatenate([np.zeros(n_p, dtype=np.int64),
+                           np.ones(n_p*n_d, dtype=np.int64),
+                           np.ones(len(p), dtype=np.int64),
+                           cap_teach, cap_others])
+    need = int(cap_teach.sum() + cap_others.sum())
+    return rows, cols, caps, np.stack([p, j], axis=1), others[-1] + 1, need
+
+
+def solve_flow(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+               prop=0.5, hist=None, pre=None, incumbent=None,
+               time_limit=None):
+    """Solves an instance where flow_applies, in polynomial time. The
+    maximum workload is bisected, and each cap is checked with a max-flow
+    through flow_network (Dinic's algorithm of scipy). About log2(n_d)
+    max-flows are needed, since everyone works at most once a day.
+
+    Args:
+        Same as src.optim.solve
+        pre (Presolved): The result of run_presolve, if already known
+        incumbent (ndarray): A known schedule, its workload is the first
+        upper bound of the bisection if it is feasible
+        time_limit (float): Wall-clock budget in seconds, checked between
+        the max-flows. The best schedule so far is then returned as
+        'optimal_inaccurate'
+
+    Returns:
+        Same as src.optim.solve, (status, solution, value)
+    """
+    start = time.time()
+    if pre is None:
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+    if len(pre.conflicts) > 0:
+        return 'infeasible', None, None
+    rows, cols, caps, cells, n_nodes, need = flow_network(
+        n_p, n_d, n_s, T, demand, pre)
+    if np.any(caps < 0):
+        return 'infeasible', None, None
+    past = np.zeros(n_p, dtype=np.int64) if hist is None else \
+        np.asarray(hist, dtype=np.int64).reshape(-1)
+    base = pre.fixed.sum(axis=1) + past
+
+    # Built once, only the capacities leaving the source change. The data
+    # of the matrix holds the edge numbers first, to find them after csr
+    # reorders the edges
+    graph = sp.csr_matrix((np.arange(1, len(rows) + 1, dtype=np.int32),
+                           (rows, cols)), shape=(n_nodes, n_nodes))
+    order = graph.data - 1
+
+    def max_flow(cap):
+        caps[:n_p] = np.maximum(cap - base, 0)
+        graph.data = caps[order].astype(np.int32)
+        return maximum_flow(graph, 0, 1)
+
+    free_days = pre.free.reshape(n_p, n_d, n_s).any(axis=2).sum(axis=1)
+    lo = workload_bound(n_p, demand, hist, pre.fixed)
+    hi = int((base + free_days).max())
+    best = None
+    if incumbent is not None:
+        incumbent = np.int8(incumbent)
+        if validate(incumbent, (n_p, n_d, n_s, G, T, M, indisp, forced,
+                                slot_choice, demand), prop=prop)[0]:
+            best = incumbent
+            hi = min(hi, int((incumbent.sum(axis=1) + past).max()))
+    # The even spread bound is often reached, then one max-flow is enough
+    res = max_flow(lo)
+    if res.flow_value == need:
+        hi = lo
+    else:
+        lo += 1
+        # The incumbent already meets hi, otherwise it is checked
+        res = None
+        if best is None:
+            res = max_flow(hi)
+            if res.flow_value < need:
+                return 'infeasible', None, None
+    while lo < hi:
+        if time_limit is not None and time.time() - start > time_limit:
+            break
+        mid = (lo + hi)//2
+        mid_res = max_flow(mid)
+        if mid_res.flow_value == need:
+            hi, res = mid, mid_res
+        else:
+            lo = mid + 1
+
+    status = 'optimal' if lo >= hi else 'optimal_inaccurate'
+    if res is None:
+        return status, best, int((best.sum(axis=1) + past).max())
+    sol = pre.fixed.copy()
+    # Without free cells (e.g. everything forced) the schedule is the fixed
+    # one, and scipy returns a sparse matrix for an empty fancy index
+    if len(cells) > 0:
+        edges = slice(n_p + n_p*n_d, n_p + n_p*n_d + len(cells))
+        used = np.asarray(res.flow[rows[edges], cols[edges]]).reshape(-1) > 0
+        sol[cells[used, 0], cells[used, 1]] = 1
+    return status, sol, int((sol.sum(axis=1) + past).max())
+
+
+if __name__ == "__main__":
+    from src.optim import solve
+    from src.tests import validate
+    from src.benchmark import generate_instance
+    # Regression check of the schedules without any free cell, e.g. fully
+    # forced: a hand-made one and the small random ones where it happens
+    zeros_ = np.zeros(2, dtype=np.int8)
+    cases_ = [(2, 1, 1, zeros_, zeros_, zeros_, [], [(0, 0)],
+               np.int8([[1], [0]]), np.int8([1]))]
+    cases_ += [generate_instance(3, 1, 2, seed=seed_, n_forced=2)
+               for seed_ in range(100)]
+    for case_ in cases_:
+        status_, sol_, value_ = solve(*case_, backend='highs')
+        assert sol_ is None or validate(sol_, case_)[0], case_
+    print('{} instances solved'.format(len(cases_)))
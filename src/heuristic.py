@@ -0,0 +1,207 @@
+import time
+import numpy as np
+from src.optim import run_presolve
+from src.milp import workload_bound
+
+
+def fill_slot(j, cand, load, G, T, M, demand, prop, sol):
+    """Greedily fills column j of sol, which already has its forced people,
+    taking the least loaded candidates first.
+
+    Returns:
+        bool: True if the demand and the attribute rules of j were met
+    """
+    taken = sol[:, j].astype(bool)
+    need = demand[j] - taken.sum()
+    if need < 0:
+        return False
+    # Least loaded first, cand is a boolean mask of the available people
+    order = np.lexsort((np.arange(len(load)), load))
+    order = order[cand[order]]
+    if demand[j] > 1:
+        men_cap = int(np.floor(prop*demand[j] + 1e-9))
+        n_teach = T[taken].sum()
+        if n_teach > 1:
+            return False
+        if n_teach == 0:
+            teach = order[T[order] == 1]
+            if G[taken].sum() >= men_cap:
+                teach = teach[G[teach] == 0]
+            if len(teach) == 0 or need == 0:
+                return False
+            # Mature teachers are scarce, only takes one when the slot has
+            # no mature person yet and no mature non-teacher can come
+            pick = teach[0]
+            no_matur = M[taken].sum() == 0 and (need == 1 or not np.any(
+                (T[order] == 0) & (M[order] == 1) & ~taken[order]))
+            if no_matur and M[pick] == 0 and np.any(M[teach] == 1):
+                pick = teach[M[teach] == 1][0]
+            taken[pick] = True
+            need -= 1
+        # The only teacher is already there
+        order = order[(T[order] == 0) & ~taken[order]]
+        if M[taken].sum() == 0:
+            matur = order[M[order] == 1]
+            if G[taken].sum() >= men_cap:
+                matur = matur[G[matur] == 0]
+            if len(matur) == 0 or need == 0:
+                return False
+            taken[matur[0]] = True
+            need -= 1
+            order = order[order != matur[0]]
+        # Men only up to the cap
+        men_left = men_cap - G[taken].sum()
+        if men_left < 0:
+            return False
+        men = order[G[order] == 1][:men_left]
+        order = order[(G[order] == 0) | np.isin(order, men)]
+    else:
+        order = order[~taken[order]]
+    if len(order) < need:
+        return False
+    taken[order[:need]] = True
+    sol[:, j] = taken
+    return True
+
+
+def greedy(n_p, n_d, n_s, G, T, M, pre, demand, prop=0.5, hist=None):
+    """Greedy fill, day by day and, within a day, the scarcest slots first.
+    The past workload hist counts in the load of each person.
+
+    Returns:
+        ndarray: The (n_p, n_d*n_s) schedule, or None if it got stuck
+    """
+    sol = pre.fixed.copy()
+    load = sol.sum(axis=1) + past_load(n_p, hist)
+    for d in range(n_d):
+        cols = np.arange(d*n_s, (d+1)*n_s)
+        scarcity = pre.free[:, cols].sum(axis=0) - demand[cols]
+        for j in cols[np.argsort(scarcity, kind='stable')]:
+            busy = sol[:, d*n_s:(d+1)*n_s].sum(axis=1) > 0
+            cand = pre.free[:, j] & ~busy
+            before = sol[:, j].copy()
+            if not fill_slot(j, cand, load, G, T, M, demand, prop, sol):
+                return None
+            load += sol[:, j] - before
+    return sol
+
+
+def past_load(n_p, hist):
+    if hist is None:
+        return np.zeros(n_p, dtype=np.int64)
+    return np.asarray(hist, dtype=np.int64).reshape(n_p)
+
+
+def local_search(n_p, n_d, n_s, G, T, M, pre, demand, sol, prop=0.5,
+                 max_iter=10000, hist=None, deadline=None):
+    """Lowers the maximum workload by moving assignments away from the most
+    loaded people. A move gives one assignment to someone free that day; if
+    no one is, a swap lets someone working another slot of that day take it
+    and hands their own slot to a third person. It stops at the deadline,
+    a time.time() value, if given.
+    """
+    past = past_load(n_p, hist)
+    load = sol.sum(axis=1) + past
+    lower = workload_bound(n_p, demand, hist, pre.fixed)
+    cap = np.floor(prop*np.asarray(demand) + 1e-9)
+
+    def can_take(q, p, j):
+        # q replaces p in column j keeping the attribute rules
+        if not pre.free[q, j] or sol[q, j]:
+            return False
+        if demand[j] <= 1:
+            return True
+        col = sol[:, j].astype(bool)
+        if T[q] != T[p]:
+            return False
+        if G[q] > G[p] and G[col].sum() + 1 > cap[j]:
+            return False
+        if M[p] > M[q] and M[col].sum() == 1:
+            return False
+        return True
+
+    for it in range(max_iter):
+        if deadline is not None and time.time() > deadline:
+            break
+        top = load.max()
+        if top <= lower:
+            break
+        moved = False
+        for p in np.flatnonzero(load == top):
+            for j in np.flatnonzero(sol[p] & pre.free[p]):
+                d = j // n_s
+                day = sol[:, d*n_s:(d+1)*n_s].sum(axis=1) > 0
+                # Move: someone off that day with a load at most top - 2
+                for q in np.flatnonzero(~day & (load <= top - 2)):
+                    if can_take(q, p, j):
+                        sol[p, j], sol[q, j] = 0, 1
+                        load[p] -= 1
+                        load[q] += 1
+                        moved = True
+                        break
+                if moved:
+                    break
+                # Swap: q leaves its slot j2 of that day for j, and r takes j2
+                for q in np.flatnonzero(day & (load <= top - 1)):
+                    if q == p:
+                        continue
+                    j2 = d*n_s + np.flatnonzero(sol[q, d*n_s:(d+1)*n_s])[0]
+                    if not pre.free[q, j2] or not can_take(q, p, j):
+                        continue
+                    sol[p, j], sol[q, j] = 0, 1
+                    for r in np.flatnonzero(~day & (load <= top - 2)):
+                        if can_take(r, q, j2):
+                            sol[q, j2], sol[r, j2] = 0, 1
+                            load[p] -= 1
+                            load[r] += 1
+                            moved = True
+                            break
+                    if moved:
+                        break
+                    sol[p, j], sol[q, j] = 1, 0
+                if moved:
+                    break
+            if moved:
+                break
+        if not moved:
+            break
+    return sol
+
+
+def solve_heuristic(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                    demand, prop=0.5, hist=None, max_iter=10000,
+                    time_limit=None, pre=None):
+    """Fast schedule without optimality proof, a greedy fill followed by a
+    move and swap local search on the maximum workload.
+
+    The result can be handed to the exact solver as its incumbent, e.g.
+    solve(..., backend='highs', incumbent=sol), or by setting it as the
+    sol of a ScheduleModel.
+
+    Args:
+        Same as src.optim.solve
+        max_iter (int): Maximum number of local search moves
+        time_limit (float): Wall-clock budget of the local search, in seconds
+        pre (Presolved): The result of run_presolve, if already known
+
+    Returns:
+        Same as src.optim.solve, (status, solution, value). The status is
+        'optimal_inaccurate' when a schedule was found, since it is not
+        proven optimal, and 'infeasible_inaccurate' when the greedy fill got
+        stuck, which does not prove that the instance is infeasible.
+    """
+    deadline = None if time_limit is None else time.time() + time_limit
+    if pre is None:
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+    if len(pre.conflicts) > 0:
+        return 'infeasible', None, None
+    G, T, M = [np.asarray(a, dtype=np.int64).reshape(-1) for a in (G, T, M)]
+    demand = np.asarray(demand, dtype=np.int64).reshape(-1)
+    sol = greedy(n_p, n_d, n_s, G, T, M, pre, demand, prop, hist)
+    if sol is None:
+        return 'infeasible_inaccurate', None, None
+    sol = local_search(n_p, n_d, n_s, G, T, M, pre, demand, sol, prop,
+                       max_iter, hist, deadline)
+    load = sol.sum(axis=1) + past_load(n_p, hist)
+    return 'optimal_inaccurate', np.int8(sol), int(load.max())
@@ -0,0 +1,438 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from collections import namedtuple
+from scipy.optimize import milp, LinearConstraint, Bounds
+from src.optim import (day_matrix, indisp_cells, run_presolve, SolveStats,
+                        people_classes, split_classes)
+
+
+# Translates the scipy.optimize.milp status codes into the same status
+# strings cvxpy returns, so both backends can be used interchangeably.
+MILP_STATUS = {0: 'optimal',
+               1: 'optimal_inaccurate',
+               2: 'infeasible',
+               3: 'unbounded',
+               4: 'solver_error'}
+
+
+def build_structure(n_p, n_d, n_s, G, T, M):
+    """Builds the constraint matrix of the scheduling MILP. It only depends
+    on the people and on the size of the schedule, so it can be compiled
+    once and reused while demand, indisp, forced and slot_choice change.
+
+    The variables are the entries of X flattened row by row (X[p, j] is
+    variable p*n_d*n_s + j) followed by a last integer variable t, the
+    maximum workload, which is the objective. The rows are, in order, the
+    demand, gender, teacher and maturity rows (one per column of X each),
+    the no-repeat rows (one per person and day) and the workload rows (one
+    per person).
+
+    Args:
+        Same as src.optim.solve
+
+    Returns:
+        A (csr_matrix): The constraint matrix
+    """
+    N = n_d*n_s
+    eye = sp.identity(N, format='csr')
+    rows = [sp.kron(np.ones((1, n_p)), eye),
+            sp.kron(np.reshape(G, (1, n_p)), eye),
+            sp.kron(np.reshape(T, (1, n_p)), eye),
+            sp.kron(np.reshape(M, (1, n_p)), eye),
+            sp.kron(sp.identity(n_p), day_matrix(n_d, n_s).T)]
+    A = sp.hstack([sp.vstack(rows), sp.csr_matrix((4*N + n_p*n_d, 1))])
+    # Workload rows, sum_j X[p, j] - t <= 0
+    work = sp.hstack([sp.kron(sp.identity(n_p), np.ones((1, N))),
+                      -np.ones((n_p, 1))])
+    return sp.vstack([A, work], format='csr')
+
+
+def build_rhs(n_p, n_d, n_s, demand, prop=0.5, hist=None):
+    """Builds the lower and upper bounds of the rows of build_structure.
+    The gender, teacher and maturity rows of the slots with a demand of one
+    or less are left free. The past workload hist is moved to the right
+    hand side of the workload rows.
+
+    Returns:
+        a_lo (ndarray): Lower bounds of the rows
+        a_hi (ndarray): Upper bounds of the rows
+    """
+    N = n_d*n_s
+    a_lo = np.full(4*N + n_p*n_d + n_p, -np.inf)
+    a_hi = np.full(4*N + n_p*n_d + n_p, np.inf)
+    if demand is not None:
+        demand = np.asarray(demand, dtype=np.float64).reshape(-1)
+        multi = demand > 1
+        a_lo[:N] = demand
+        a_hi[:N] = demand
+        a_hi[N:2*N][multi] = prop*demand[multi]
+        a_lo[2*N:3*N][multi] = 1
+        a_hi[2*N:3*N][multi] = 1
+        a_lo[3*N:4*N][multi] = 1
+    a_hi[4*N:4*N + n_p*n_d] = 1
+    a_hi[4*N + n_p*n_d:] = 0
+    if hist is not None:
+        a_hi[4*N + n_p*n_d:] = -np.asarray(hist, dtype=np.float64)
+    return a_lo, a_hi
+
+
+def build_bounds(n_p, n_d, n_s, indisp, forced, slot_choice, hist=None):
+    """Builds the variable bounds. Slot choice and indisponibility are upper
+    bounds and the forced cells are lower bounds.
+
+    Returns:
+        lb (ndarray): Lower bounds of the variables
+        ub (ndarray): Upper bounds of the variables
+    """
+    N = n_d*n_s
+    # Any preference level above 0 means available
+    ub = np.tile(np.minimum(slot_choice, 1).astype(np.float64), (1, n_d))
+    ind_cells = indisp_cells(n_d, n_s, indisp)
+    ub[ind_cells[:, 0], ind_cells[:, 1]] = 0
+    lb = np.zeros((n_p, N))
+    forced = np.asarray(forced, dtype=np.int64).reshape(-1, 2)
+    lb[forced[:, 0], forced[:, 1]] = 1
+    t_max = N if hist is None else N + np.max(hist)
+    return np.append(lb.reshape(-1), 0), np.append(ub.reshape(-1), t_max)
+
+
+def build_milp(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+               prop=0.5, hist=None):
+    """Builds the scheduling problem directly as a sparse MILP in the form
+    expected by scipy.optimize.milp, without going through cvxpy.
+
+    Args:
+        Same as src.optim.solve
+
+    Returns:
+        c (ndarray): The objective vector
+        A (csr_matrix): The constraint matrix
+        a_lo (ndarray): Lower bounds of the rows of A
+        a_hi (ndarray): Upper bounds of the rows of A
+        lb (ndarray): Lower bounds of the variables
+        ub (ndarray): Upper bounds of the variables
+        integrality (ndarray): 1 for every variable, they are all integers
+    """
+    A = build_structure(n_p, n_d, n_s, G, T, M)
+    a_lo, a_hi = build_rhs(n_p, n_d, n_s, demand, prop, hist)
+    lb, ub = build_bounds(n_p, n_d, n_s, indisp, forced, slot_choice, hist)
+    c = np.zeros(A.shape[1])
+    c[-1] = 1
+    integrality = np.ones(A.shape[1])
+    return c, A, a_lo, a_hi, lb, ub, integrality
+
+
+def run_milp(c, A, a_lo, a_hi, lb, ub, integrality, pre=None, options=None,
+             stats=None):
+    """Solves a MILP from build_milp with HiGHS. If the result of
+    src.optim.run_presolve is given only its free cells are kept as
+    variables, the fixed ones are moved to the right hand side. If a
+    SolveStats is given, the reduction is timed as canonicalization and the
+    solver statistics are recorded.
+
+    Returns:
+        status (str): The cvxpy-like status
+        x (ndarray): The full vector of variables, or None
+        res (OptimizeResult): The raw result of scipy.optimize.milp
+    """
+    # Contradictory bounds (e.g. someone forced on an indisponible day)
+    if np.any(lb > ub):
+        return 'infeasible', None, None
+
+    if stats is None:
+        stats = SolveStats()
+    # The workload variable t, and any other after the cells, is always kept
+    keep = np.ones(len(c), dtype=bool)
+    x = np.zeros(len(c))
+    with stats.phase('canonicalization'):
+        if pre is not None:
+            n_cells = pre.free.size
+            keep[:n_cells] = pre.free.reshape(-1)
+            x[:n_cells] = pre.fixed.reshape(-1)
+            shift = A.dot(x)
+            A = A[:, keep]
+            a_lo, a_hi = a_lo - shift, a_hi - shift
+            c, lb, ub, integrality = (c[keep], lb[keep], ub[keep],
+                                      integrality[keep])
+    stats.n_variables = len(c)
+    stats.n_constraints = A.shape[0]
+
+    with stats.phase('solver'):
+        res = milp(c, constraints=LinearConstraint(A, a_lo, a_hi),
+                   integrality=integrality, bounds=Bounds(lb, ub),
+                   options=options)
+    stats.nodes = getattr(res, 'mip_node_count', None)
+    stats.mip_gap = getattr(res, 'mip_gap', None)
+    status = MILP_STATUS.get(res.status, 'solver_error')
+    if res.x is None:
+        return status, None, res
+    x[keep] = res.x
+    return status, x, res
+
+
+def workload(sol, hist=None):
+    """The maximum workload of a solution, including the past one."""
+    load = np.sum(sol, axis=1)
+    if hist is not None:
+        load = load + np.asarray(hist)
+    return load.max()
+
+
+def workload_bound(n_p, demand, hist=None, fixed=None):
+    """A lower bound on the maximum workload: the total demand, plus the
+    past workload, spread evenly among everyone. If the (n_p, n_d*n_s)
+    fixed cells of run_presolve are given, also the largest workload that
+    they (and the past one) already force on someone.
+    """
+    past = np.zeros(n_p) if hist is None else np.asarray(hist).reshape(n_p)
+    bound = int(np.ceil((np.sum(demand) + past.sum()) / float(n_p)))
+    if fixed is not None:
+        bound = max(bound, int((np.sum(fixed, axis=1) + past).max()))
+    return bound
+
+
+def is_feasible(A, a_lo, a_hi, lb, ub, x, tol=1e-9):
+    """Checks a full vector of variables against a MILP from build_milp."""
+    ax = A.dot(x)
+    return bool(np.all(ax >= a_lo - tol) and np.all(ax <= a_hi + tol)
+                and np.all(x >= lb - tol) and np.all(x <= ub + tol))
+
+
+def milp_options(time_limit=None, mip_gap=None):
+    """The HiGHS options of scipy.optimize.milp for a wall-clock budget in
+    seconds and a relative MIP gap."""
+    options = {}
+    if time_limit is not None:
+        options['time_limit'] = max(float(time_limit), 0.)
+    if mip_gap is not None:
+        options['mip_rel_gap'] = float(mip_gap)
+    return options
+
+
+def solve_milp(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+               prop=0.5, hist=None, presolve=True, incumbent=None, stats=None,
+               time_limit=None, mip_gap=None, pre=None):
+    """Solves the scheduling problem with HiGHS through scipy.optimize.milp,
+    running in-process and skipping the cvxpy canonicalization.
+
+    Args:
+        Same as src.optim.solve
+        incumbent (ndarray): A known (n_p, n_d*n_s) schedule, e.g. from
+        src.heuristic. If it is feasible its workload caps the objective and
+        it is returned when the solver finds nothing better.
+        stats (SolveStats): Filled with the timings and solver statistics
+        time_limit (float): Wall-clock budget of the solver, in seconds.
+        Without an incumbent, the one of src.heuristic is used, so there is
+        a schedule to return when the budget runs out
+        mip_gap (float): Relative gap at which the solver stops
+        pre (Presolved): The result of run_presolve, if already known
+
+    Returns:
+        Same as src.optim.solve, (status, solution, value)
+    """
+    if stats is None:
+        stats = SolveStats()
+    stats.backend = 'highs'
+    with stats.phase('build'):
+        if not presolve:
+            pre = None
+        elif pre is None:
+            pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                               slot_choice, demand, prop)
+        if pre is None or len(pre.conflicts) == 0:
+            c, A, a_lo, a_hi, lb, ub, integrality = build_milp(
+                n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+                prop, hist)
+    if pre is not None and len(pre.conflicts) > 0:
+        return stats.done('infeasible', None, None)
+
+    if incumbent is None and time_limit is not None:
+        # Something to return if the budget runs out before any schedule
+        from src.heuristic import solve_heuristic
+        incumbent = solve_heuristic(n_p, n_d, n_s, G, T, M, indisp, forced,
+                                    slot_choice, demand, prop, hist)[1]
+    best = None
+    if incumbent is not None:
+        x = np.append(incumbent.reshape(-1), workload(incumbent, hist))
+        if is_feasible(A, a_lo, a_hi, lb, ub, x):
+            best = int(x[-1])
+            ub[-1] = best
+            # Already at the bound of the total demand spread evenly
+            if best <= workload_bound(n_p, demand, hist):
+                return stats.done('optimal', np.int8(incumbent), best)
+
+    status, x, res = run_milp(c, A, a_lo, a_hi, lb, ub, integrality, pre=pre,
+                              options=milp_options(time_limit, mip_gap),
+                              stats=stats)
+    if x is None:
+        if best is not None and status == 'infeasible':
+            # Nothing better than the incumbent exists
+            return stats.done('optimal', np.int8(incumbent), best)
+        if best is not None and status == 'optimal_inaccurate':
+            # Out of time before improving on it
+            return stats.done(status, np.int8(incumbent), best)
+        return stats.done(status, None, None)
+
+    with stats.phase('postprocess'):
+        # Rebuilds the full n_p x n_d*n_s solution
+        sol = np.int8(x[:-1].round().reshape(n_p, n_d*n_s))
+        value = int(round(x[-1]))
+    return stats.done(status, sol, value)
+
+
+def solve_classes(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                  demand, prop=0.5, hist=None, stats=None, time_limit=None,
+                  mip_gap=None):
+    """Solves the scheduling problem over classes of interchangeable people
+    (see src.optim.people_classes) instead of over each person.
+
+    The model is the one of build_milp for one representative per class,
+    with X[c, j] counting the people of class c in column j: its bounds and
+    no-repeat rows are scaled by the class size, and its workload rows
+    become sum_j X[c, j] <= size_c * (t - hist_c). Any such counts split
+    into individual schedules with a maximum workload of t (see
+    src.optim.split_classes), so the optimum is the same as the one of the
+    per-person model, with as many fewer variables as people per class.
+
+    Args:
+        Same as solve_milp
+
+    Returns:
+        Same as src.optim.solve, (status, solution, value)
+    """
+    if stats is None:
+        stats = SolveStats()
+    stats.backend = 'highs'
+    with stats.phase('build'):
+        labels, reps, sizes = people_classes(n_p, n_d, G, T, M, indisp,
+                                             forced, slot_choice, hist)
+        n_c, N = len(reps), n_d*n_s
+        rep_class = dict(zip(reps.tolist(), range(n_c)))
+        c_indisp = [(rep_class[p], d) for p, d in indisp if p in rep_class]
+        c_forced = [(labels[p], j) for p, j in forced]
+        c_hist = None if hist is None else np.asarray(hist)[reps]
+        c, A, a_lo, a_hi, lb, ub, integrality = build_milp(
+            n_c, n_d, n_s, np.asarray(G)[reps], np.asarray(T)[reps],
+            np.asarray(M)[reps], c_indisp, c_forced,
+            np.asarray(slot_choice)[reps], demand, prop, c_hist)
+        work = sp.hstack([sp.kron(sp.identity(n_c), np.ones((1, N))),
+                          -sizes.reshape(-1, 1)])
+        A = sp.vstack([A[:-n_c], work], format='csr')
+        a_hi[4*N:4*N + n_c*n_d] = np.repeat(sizes, n_d)
+        a_hi[4*N + n_c*n_d:] *= sizes
+        ub[:-1] *= np.repeat(sizes, N)
+
+    status, x, res = run_milp(c, A, a_lo, a_hi, lb, ub, integrality,
+                              options=milp_options(time_limit, mip_gap),
+                              stats=stats)
+    if x is None:
+        return stats.done(status, None, None)
+    with stats.phase('postprocess'):
+        Y = np.int64(x[:-1].round().reshape(n_c, N))
+        sol = split_classes(Y, labels, n_d, n_s, hist)
+        value = int(workload(sol, hist))
+    return stats.done(status, sol, value)
+
+
+# One improving schedule of iter_incumbents. bound is a lower bound on the
+# optimum, gap the relative gap (value - bound) / value and time the seconds
+# since the start.
+Incumbent = namedtuple('Incumbent', ['sol', 'value', 'bound', 'gap', 'time'])
+
+
+def iter_incumbents(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                    demand, prop=0.5, hist=None, time_limit=None,
+                    mip_gap=None, incumbent=None, pre=None, start=None):
+    """Anytime solve, yields every improving schedule as soon as it is
+    found, so the best one so far can be published before the end.
+
+    The first schedule is the incumbent if given, or else the one of
+    src.heuristic. Then the workload cap is bisected between the bound and
+    the last value, and each HiGHS run only looks for a feasible schedule
+    under the cap, which is much faster than proving its optimality. A
+    feasible cap gives a new schedule, an infeasible one raises the bound,
+    and the last schedule is yielded again with its new gap. When they
+    meet it is optimal, with a zero gap.
+
+    Args:
+        Same as solve_milp
+        time_limit (float): Wall-clock budget in seconds, for the model, the
+        heuristic and all the runs. What is left of it is given to each run
+        mip_gap (float): Stops once the relative gap is at most this
+        pre (Presolved): The result of run_presolve, if already known
+        start (float): The time.time() at which the budget started, now by
+        default
+
+    Yields:
+        Incumbent: (sol, value, bound, gap, time), with decreasing gaps
+
+    Returns:
+        str: How it ended (the value of its StopIteration): 'optimal' when
+        the last schedule is proven optimal or within mip_gap,
+        'infeasible' when HiGHS proved that there is no schedule, and
+        'user_limit' when the time ran out or HiGHS stopped early
+    """
+    if start is None:
+        start = time.time()
+    if pre is None:
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+    if len(pre.conflicts) > 0:
+        return 'infeasible'
+    c, A, a_lo, a_hi, lb, ub, integrality = build_milp(
+        n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand, prop,
+        hist)
+    bound = workload_bound(n_p, demand, hist, pre.fixed)
+
+    def found(sol, value, bound):
+        gap = (value - bound) / float(value) if value > 0 else 0.
+        return Incumbent(sol, value, bound, gap, time.time() - start)
+
+    if incumbent is not None:
+        x = np.append(incumbent.reshape(-1), workload(incumbent, hist))
+        if not is_feasible(A, a_lo, a_hi, lb, ub, x):
+            incumbent = None
+    if incumbent is None:
+        from src.heuristic import solve_heuristic
+        incumbent = solve_heuristic(n_p, n_d, n_s, G, T, M, indisp, forced,
+                                    slot_choice, demand, prop, hist)[1]
+    sol, value = None, None
+    if incumbent is not None:
+        sol, value = np.int8(incumbent), int(workload(incumbent, hist))
+        yield found(sol, value, bound)
+
+    # Feasibility runs, any schedule under the cap is an improvement.
+    # HiGHS only checks its time limit after its presolve, so the largest
+    # overrun of a run so far is kept out of the budget of the next ones
+    c = np.zeros(len(c))
+    overrun = 0.
+    while True:
+        cap = None
+        if value is not None:
+            if value <= bound or (mip_gap is not None
+                                  and found(sol, value, bound).gap <= mip_gap):
+                return 'optimal'
+            cap = (bound + value - 1) // 2
+            lb[-1], ub[-1] = 0, cap
+        left = None
+        if time_limit is not None:
+            left = time_limit - (time.time() - start) - overrun
+            if left <= 0:
+                return 'user_limit'
+        run_start = time.time()
+        status, x, res = run_milp(c, A, a_lo, a_hi, lb, ub, integrality,
+                                  pre=pre, options=milp_options(left))
+        if left is not None:
+            overrun = max(overrun, time.time() - run_start - left)
+        if x is not None:
+            sol = np.int8(x[:-1].round().reshape(n_p, n_d*n_s))
+            value = int(workload(sol, hist))
+        elif status != 'infeasible':
+            return 'user_limit'
+        elif cap is None:
+            return 'infeasible'
+        else:
+            # Nothing at or under the cap
+            bound = cap + 1
+        yield found(sol, value, min(bound, value))
@@ -0,0 +1,237 @@
+import numpy as np
+import scipy.sparse as sp
+from src.optim import run_presolve
+from src.milp import (build_structure, build_rhs, build_bounds, run_milp,
+                      is_feasible, workload, workload_bound)
+from src.repair import repair, broken_days
+
+
+class ScheduleModel(object):
+    """A scheduling problem that is compiled once and re-solved as its
+    parameters change.
+
+    The constraint matrix only depends on the people (G, T, M) and on the
+    size of the schedule, so it is built once in the constructor. demand,
+    indisp, forced, slot_choice and prop are plain attributes that can be
+    reassigned or edited in place (e.g. model.indisp.append((p, d))) between
+    calls to solve, which only recomputes the bounds.
+
+    Every solve starts from the previous solution: if it is no longer
+    feasible it is first repaired on the edited days (see src.repair), then
+    it becomes the incumbent, its workload caps the objective, and if it
+    already reaches the lower bound it is returned without calling the
+    solver. When the edits only took options away (e.g. a new
+    indisponibility), the previous optimum is such a lower bound.
+
+    solve_lexicographic breaks the ties of the maximum workload, first by
+    the spread of the workloads and then by the preferred ("Gosto") slots.
+    """
+
+    def __init__(self, n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                 demand, prop=0.5, hist=None):
+        self.n_p = n_p
+        self.n_d = n_d
+        self.n_s = n_s
+        self.G = G
+        self.T = T
+        self.M = M
+        self.indisp = list(indisp)
+        self.forced = list(forced)
+        self.slot_choice = np.array(slot_choice)
+        self.demand = np.array(demand)
+        self.prop = prop
+        self.hist = hist
+        self.A = build_structure(n_p, n_d, n_s, G, T, M)
+        self.c = np.zeros(self.A.shape[1])
+        self.c[-1] = 1
+        self.integrality = np.ones(self.A.shape[1])
+        self.A_lex = None
+        self.sol = None
+        self.value = None
+        # Parameters and value of the last proven optimum, see tightened
+        self.last = None
+        self.last_value = None
+
+    def params(self):
+        """Returns the current parameters in the order taken by solve."""
+        return (self.n_p, self.n_d, self.n_s, self.G, self.T, self.M,
+                self.indisp, self.forced, self.slot_choice, self.demand)
+
+    def is_feasible(self, sol):
+        """Checks a (n_p, n_d*n_s) solution against the current parameters.
+        """
+        a_lo, a_hi = build_rhs(self.n_p, self.n_d, self.n_s, self.demand,
+                               self.prop, self.hist)
+        lb, ub = build_bounds(self.n_p, self.n_d, self.n_s, self.indisp,
+                              self.forced, self.slot_choice, self.hist)
+        x = np.append(sol.reshape(-1), workload(sol, self.hist))
+        return is_feasible(self.A, a_lo, a_hi, lb, ub, x)
+
+    def snapshot(self):
+        """Copies the parameters that solve can be re-run with."""
+        return (set(map(tuple, self.indisp)), set(map(tuple, self.forced)),
+                np.minimum(self.slot_choice, 1), self.demand.copy(),
+                self.prop, None if self.hist is None else np.array(self.hist))
+
+    def tightened(self):
+        """Whether the parameters only lost options since the last proven
+        optimum: more indisp and forced entries, fewer available slots, a
+        lower prop and the same demand and hist. Its value then bounds the
+        new optimum from below.
+        """
+        if self.last is None:
+            return False
+        indisp, forced, avail, demand, prop, hist = self.last
+        now = self.snapshot()
+        return (indisp <= now[0] and forced <= now[1]
+                and np.array_equal(avail.shape, now[2].shape)
+                and np.all(now[2] <= avail)
+                and np.array_equal(demand, now[3]) and now[4] <= prop
+                and (hist is None) == (now[5] is None)
+                and (hist is None or np.array_equal(hist, now[5])))
+
+    def lower_bound(self):
+        """A simple bound on the maximum workload, the total demand (plus the
+        past workload) spread evenly among everyone, or the last optimum if
+        the parameters were only tightened since.
+        """
+        bound = workload_bound(self.n_p, self.demand, self.hist)
+        if self.tightened():
+            bound = max(bound, self.last_value)
+        return bound
+
+    def optimal(self, sol, value):
+        """Keeps a proven optimum as the start of the next solve."""
+        self.sol, self.value = sol, value
+        self.last, self.last_value = self.snapshot(), value
+        return 'optimal', sol, value
+
+    def repair(self, sol):
+        """Repairs the previous solution into a feasible one of the same
+        maximum workload, reopening the days broken by the edits and their
+        neighbors if needed (see src.repair.repair).
+
+        Returns:
+            ndarray: The repaired schedule, or None
+        """
+        broken = broken_days(sol, self.params(), self.prop)
+        if len(broken) == 0:
+            return None
+        return repair(self.params(), sol, prop=self.prop, hist=self.hist,
+                      max_workload=self.value, days=broken)[1]
+
+    def solve(self, presolve=True):
+        """Solves the model with its current parameters, warm-started from
+        the previous solution, repaired if the edits broke it.
+
+        Returns:
+            Same as src.optim.solve, (status, solution, value)
+        """
+        n_p, n_d, n_s = self.n_p, self.n_d, self.n_s
+        pre = None
+        if presolve:
+            pre = run_presolve(*self.params(), prop=self.prop)
+            if len(pre.conflicts) > 0:
+                return 'infeasible', None, None
+
+        a_lo, a_hi = build_rhs(n_p, n_d, n_s, self.demand, self.prop,
+                               self.hist)
+        lb, ub = build_bounds(n_p, n_d, n_s, self.indisp, self.forced,
+                              self.slot_choice, self.hist)
+        incumbent = self.sol
+        if incumbent is not None and not self.is_feasible(incumbent):
+            incumbent = self.repair(incumbent)
+        if incumbent is not None:
+            value = int(workload(incumbent, self.hist))
+            if value <= self.lower_bound():
+                return self.optimal(incumbent, value)
+            # Nothing worse than the incumbent needs to be explored
+            ub[-1] = value
+
+        status, x, res = run_milp(self.c, self.A, a_lo, a_hi, lb, ub,
+                                  self.integrality, pre=pre)
+        if x is None:
+            if incumbent is not None:
+                return self.optimal(incumbent, value)
+            return status, None, None
+
+        sol = np.int8(x[:-1].round().reshape(n_p, n_d*n_s))
+        value = int(round(x[-1]))
+        if status == 'optimal':
+            return self.optimal(sol, value)
+        self.sol, self.value = sol, value
+        return status, sol, value
+
+    def build_lexicographic(self):
+        """Extends A with a last variable u, the minimum workload, and one
+        row per person, sum_j X[p, j] - u >= -hist[p]. It only depends on
+        the sizes, so it is built once, on the first lexicographic solve.
+        """
+        if self.A_lex is None:
+            n_p, N = self.n_p, self.n_d*self.n_s
+            least = sp.hstack([sp.kron(sp.identity(n_p), np.ones((1, N))),
+                               sp.csr_matrix((n_p, 1)), -np.ones((n_p, 1))])
+            A = sp.hstack([self.A, sp.csr_matrix((self.A.shape[0], 1))])
+            self.A_lex = sp.vstack([A, least], format='csr')
+        return self.A_lex
+
+    def solve_lexicographic(self, presolve=True):
+        """Solves the model in three stages on the same compiled matrix:
+
+        1. the maximum workload t is minimized, as in solve;
+        2. with t frozen at its optimum, the minimum workload u is
+           maximized, which minimizes the spread t - u;
+        3. with u frozen too, the number of assignments to preferred slots
+           (slot_choice == 2) is maximized.
+
+        Each stage starts from the optimum of the previous one, which is
+        feasible for it: its objective bounds the new one, and it is kept if
+        the solver returns nothing better.
+
+        Returns:
+            status (str): The status of the first stage
+            solution (ndarray): The (n_p, n_d*n_s) schedule, or None
+            values (tuple): The maximum workload, the spread and the number
+            of preferred assignments
+        """
+        status, sol, value = self.solve(presolve)
+        if sol is None:
+            return status, None, None
+        n_p, n_d, n_s = self.n_p, self.n_d, self.n_s
+        N = n_d*n_s
+        past = np.zeros(n_p) if self.hist is None else np.asarray(self.hist)
+        pre = None
+        if presolve:
+            pre = run_presolve(*self.params(), prop=self.prop)
+
+        A = self.build_lexicographic()
+        a_lo, a_hi = build_rhs(n_p, n_d, n_s, self.demand, self.prop,
+                               self.hist)
+        a_lo = np.concatenate([a_lo, -past])
+        a_hi = np.concatenate([a_hi, np.full(n_p, np.inf)])
+        lb, ub = build_bounds(n_p, n_d, n_s, self.indisp, self.forced,
+                              self.slot_choice, self.hist)
+        least = int((sol.sum(axis=1) + past).min())
+        # t is frozen, and the current minimum workload bounds u from below
+        lb, ub = np.append(lb, least), np.append(ub, value)
+        ub[-2] = value
+        integrality = np.ones(A.shape[1])
+
+        c = np.zeros(A.shape[1])
+        c[-1] = -1
+        status_u, x, res = run_milp(c, A, a_lo, a_hi, lb, ub, integrality,
+                                    pre=pre)
+        if x is not None:
+            sol = np.int8(x[:-2].round().reshape(n_p, N))
+            least = int(round(x[-1]))
+        lb[-1] = least
+
+        liked = np.tile(np.asarray(self.slot_choice) == 2, (1, n_d))
+        c = np.zeros(A.shape[1])
+        c[:-2] = -liked.reshape(-1).astype(np.float64)
+        status_p, x, res = run_milp(c, A, a_lo, a_hi, lb, ub, integrality,
+                                    pre=pre)
+        if x is not None:
+            sol = np.int8(x[:-2].round().reshape(n_p, N))
+        self.sol = sol
+        return status, sol, (value, value - least, int(sol[liked].sum()))
@@ -1,10 +1,19 @@
-import cvxpy as cvx
 import numpy as np
+import scipy.sparse as sp
+import json
+import time
+import datetime
+from collections import namedtuple
+from contextlib import contextmanager
 from random import randint
 import src.tests as tt
 
 
-def solve(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand, prop=0.5, hist=None):
+def solve(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand, prop=0.5, hist=None,
+          backend='cvxpy', presolve=True, incumbent=None, stats=None,
+          lexicographic=False, time_limit=None, mip_gap=None, callback=None,
+          aggregate=False, solver='GLPK_MI', portfolio=None, shard=False,
+          flow=True):
     """ Solves the Integer Programming problem that generates a schedule.
     The current constraints are, maximum of one man per slot...
 
@@ -25,10 +34,65 @@ def solve(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand, prop=0.5,
         solution. In this case the tuples are (person, day*n_s+slot).
         slot_choice (ndarray): A somewhat dense matrix of shape (n_p, n_s)
         representing the disponibility of each person to work on each slot.
-        1 means available, 0 otherwise
+        1 means available, 2 available and preferred ("Gosto"), 0 otherwise
         demand (ndarray): A (n_d*n_s) column vector of the demand of people
         for each slot.
         prop (float): Maximum proportion of men in each slot
+        hist (ndarray): The (n_p) workload each person already has from the
+        previous periods. It is added to the workload in the objective, and
+        the returned value includes it
+        backend (str): 'cvxpy' to solve through cvxpy (with GLPK_MI by
+        default, see solver), or
+        'highs' to build the sparse MILP directly and solve it in-process
+        with HiGHS (see src.milp), or 'bisection' to bisect on the maximum
+        workload with per-day subproblems solved in parallel (see
+        src.decompose), or 'heuristic' for a fast greedy and local search
+        schedule without optimality proof (see src.heuristic), or
+        'portfolio' to race several of them in parallel processes (see
+        src.portfolio)
+        presolve (bool): If True only the cells that are not already fixed
+        by slot_choice, indisp and forced become decision variables, and
+        trivially infeasible instances are detected before the solver call
+        incumbent (ndarray): A known schedule used as the starting incumbent
+        of the 'highs' backend
+        stats (SolveStats): If given it is filled with the phase timings,
+        the problem size and the solver statistics of this solve, and with
+        the failed pre-checks when the instance is found infeasible before
+        the solver call (see precheck)
+        lexicographic (bool): If True ('highs' backend only) the ties of the
+        maximum workload are broken by minimizing the spread of the
+        workloads and then maximizing the preferred slots, see
+        src.model.ScheduleModel.solve_lexicographic. The three optima are
+        kept in stats.objectives. It takes no time_limit, mip_gap,
+        callback, shard, aggregate or incumbent
+        time_limit (float): Wall-clock budget of the solver in seconds. The
+        best schedule found in time is returned as 'optimal_inaccurate'
+        mip_gap (float): Relative gap between the schedule and the bound at
+        which the solver stops
+        callback (callable): If given ('highs' backend only) the solve is
+        anytime, callback is called with every improving
+        src.milp.Incumbent (sol, value, bound, gap, time) as soon as it is
+        found, see src.milp.iter_incumbents. Without any schedule the
+        status is 'infeasible' if that is proven, else 'user_limit'. It
+        needs presolve
+        aggregate (bool): If True ('highs' backend only) the interchangeable
+        people are grouped in classes solved with integer counts, which are
+        then split back into balanced individual schedules, see
+        people_classes and src.milp.solve_classes. It takes no callback or
+        incumbent and needs presolve
+        solver (str): The cvxpy solver of the 'cvxpy' backend, e.g.
+        'GLPK_MI' or 'CBC'. The time limit and gap only reach GLPK_MI
+        portfolio (list): The entries raced by the 'portfolio' backend,
+        src.portfolio.DEFAULT_PORTFOLIO by default. The result of every
+        entry is kept in stats.portfolio
+        shard (bool): If True the instance is split in the connected
+        components of its person-slot availability graph, which are solved
+        in parallel processes with the given backend and merged, see
+        src.shard.solve_sharded. It takes no callback or incumbent
+        flow (bool): If True the instances where the gender, teacher and
+        maturity rules are only flow capacities (no demand above one, or
+        prop of 1 with mature teachers) are solved exactly as a max-flow,
+        whatever the backend, unless presolve is False, see src.flow
 
     Returns:
         solution (ndarray): A matrix of shape (n_p, n_d*n_s) where xij = 1
@@ -38,59 +102,197 @@ def solve(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand, prop=0.5,
     # source, specifically targeting the day and slot. 
     # To fix someone on a specific role you can set the other slots to 0
     # every day.
-
-    X = cvx.Bool(n_p, n_d*n_s)
+    # The time limit also covers the checks and the model building
+    start = time.time()
+    # The modes that can't honor an option refuse it instead of dropping it
+    if lexicographic:
+        reject_options('lexicographic', time_limit=time_limit is not None,
+                       mip_gap=mip_gap is not None,
+                       callback=callback is not None, shard=shard,
+                       aggregate=aggregate, incumbent=incumbent is not None)
+    if shard:
+        reject_options('shard', callback=callback is not None,
+                       incumbent=incumbent is not None)
+    if aggregate:
+        reject_options('aggregate', callback=callback is not None,
+                       incumbent=incumbent is not None,
+                       presolve=not presolve)
+    if callback is not None:
+        reject_options('callback', presolve=not presolve)
+    if stats is None:
+        stats = SolveStats()
+    stats.backend = backend
+    # The cheap counting checks run first, whatever the backend
+    with stats.phase('build'):
+        # Computed once and handed to the backends that presolve
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+        stats.conflicts = precheck(n_p, n_d, n_s, G, T, M, indisp, forced,
+                                   slot_choice, demand, prop, pre=pre)
+    if len(stats.conflicts) > 0:
+        return stats.done('infeasible', None, None)
+    if lexicographic:
+        if backend != 'highs':
+            raise ValueError('The lexicographic objective is only available '
+                             'with the "highs" backend.')
+        from src.model import ScheduleModel
+        with stats.phase('build'):
+            model = ScheduleModel(n_p, n_d, n_s, G, T, M, indisp, forced,
+                                  slot_choice, demand, prop, hist)
+        with stats.phase('solver'):
+            status, sol, values = model.solve_lexicographic(presolve)
+        stats.objectives = values
+        return stats.done(status, sol, None if values is None else values[0])
+    if shard:
+        from src.shard import solve_sharded
+        with stats.phase('solver'):
+            status, sol, value = solve_sharded(
+                n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+                prop=prop, hist=hist, pre=pre, backend=backend,
+                presolve=presolve,
+                time_limit=time_limit, mip_gap=mip_gap, aggregate=aggregate,
+                solver=solver, portfolio=portfolio)
+        return stats.done(status, sol, value)
+    if aggregate:
+        if backend != 'highs':
+            raise ValueError('The aggregated model is only available with '
+                             'the "highs" backend.')
+        from src.milp import solve_classes
+        return solve_classes(n_p, n_d, n_s, G, T, M, indisp, forced,
+                             slot_choice, demand, prop=prop, hist=hist,
+                             stats=stats, time_limit=time_limit,
+                             mip_gap=mip_gap)
+    if callback is not None:
+        if backend != 'highs':
+            raise ValueError('The callback is only available with the '
+                             '"highs" backend.')
+        from src.milp import iter_incumbents
+        last, end = None, None
+        with stats.phase('solver'):
+            runs = iter_incumbents(n_p, n_d, n_s, G, T, M, indisp, forced,
+                                   slot_choice, demand, prop, hist,
+                                   time_limit, mip_gap, incumbent, pre=pre,
+                                   start=start)
+            while end is None:
+                try:
+                    last = next(runs)
+                except StopIteration as stop:
+                    end = stop.value
+                else:
+                    callback(last)
+        if last is None:
+            # Proven infeasible, or out of time before the first schedule
+            status = 'infeasible' if end == 'infeasible' else 'user_limit'
+            return stats.done(status, None, None)
+        stats.mip_gap = last.gap
+        status = 'optimal' if last.gap == 0 else 'optimal_inaccurate'
+        return stats.done(status, last.sol, last.value)
+    if flow and presolve:
+        from src.flow import flow_applies, solve_flow
+        if flow_applies(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                        demand, prop, pre=pre):
+            stats.backend = 'flow'
+            if time_limit is not None:
+                time_limit = time_limit - (time.time() - start)
+            with stats.phase('solver'):
+                status, sol, value = solve_flow(
+                    n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                    demand, prop=prop, hist=hist, pre=pre,
+                    incumbent=incumbent, time_limit=time_limit)
+            return stats.done(status, sol, value)
+    if backend == 'portfolio':
+        from src.portfolio import solve_portfolio
+        with stats.phase('solver'):
+            status, sol, value, stats.portfolio = solve_portfolio(
+                (n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand),
+                prop, hist, portfolio, time_limit, mip_gap)
+        return stats.done(status, sol, value)
+    if backend == 'highs':
+        from src.milp import solve_milp
+        return solve_milp(n_p, n_d, n_s, G, T, M, indisp, forced,
+                          slot_choice, demand, prop=prop, hist=hist,
+                          presolve=presolve, incumbent=incumbent, stats=stats,
+                          time_limit=time_limit, mip_gap=mip_gap, pre=pre)
+    elif backend in ('bisection', 'heuristic'):
+        if backend == 'bisection':
+            from src.decompose import solve_bisection as engine
+            options = {'time_limit': time_limit, 'mip_gap': mip_gap}
+        else:
+            from src.heuristic import solve_heuristic as engine
+            options = {'time_limit': time_limit}
+        options['pre'] = pre
+        with stats.phase('solver'):
+            status, sol, value = engine(n_p, n_d, n_s, G, T, M, indisp,
+                                        forced, slot_choice, demand,
+                                        prop=prop, hist=hist, **options)
+        return stats.done(status, sol, value)
+    elif backend != 'cvxpy':
+        raise ValueError('Unknown backend "{}", use "cvxpy", "highs", '
+                         '"bisection", "heuristic" or "portfolio".'
+                         .format(backend))
+
+    # Only imported here, it is by far the slowest import of the project
+    import cvxpy as cvx
+
+    build_start = time.time()
+    N = n_d*n_s
+    if not presolve:
+        pre = None
+
+    if pre is not None and pre.free.any():
+        # Only the free cells are variables, the fixed ones are scattered in
+        # as constants (cvx.reshape and cvx.vec are column major).
+        free_idx = np.flatnonzero(pre.free.ravel(order='F'))
+        x = cvx.Bool(len(free_idx))
+        scatter = sp.csc_matrix((np.ones(len(free_idx)),
+                                 (free_idx, np.arange(len(free_idx)))),
+                                shape=(n_p*N, len(free_idx)))
+        X = cvx.reshape(scatter*x + pre.fixed.ravel(order='F'), n_p, N)
+        # Indisp, slot choice and forced are already in the fixed cells
+        indisp, forced, slot_choice = [], [], None
+    else:
+        X = cvx.Bool(n_p, N)
 
     if demand is not None:
-        # print('demand is not None, but is: ', demand)
-        demand_constr = []
-        for s in range(n_d*n_s):
-            demand_constr.append(cvx.sum_entries(X[:, s]) == demand[s])
+        demand = np.asarray(demand).reshape(-1)
+        demand_constr = [cvx.sum_entries(X, axis=0) == demand.reshape(1, N)]
 
     # This is just an example, I need to change the rest of the code to use it
     else:
-        demand_constr = [1 > 0]
+        demand_constr = []
 
-    # Date Indisponibility constraints
+    # Date Indisponibility constraints, a single selector over vec(X)
+    ind_cells = indisp_cells(n_d, n_s, indisp)
     ind_constr = []
-    for p, d in indisp:
-        # Check if the list is being correctly appended: The elements, not the list
-        ind_constr = ind_constr + [X[p, d*n_s + k] == 0 for k in range(n_s)]
-    
-    # Gender constraints
-    gend_constr = []
-    for s in range(n_d*n_s):
-        if demand[s] > 1:
-            gend_constr.append(G.reshape(1,n_p)*X[:,s] <= prop*demand[s])
+    if len(ind_cells) > 0:
+        ind_constr.append(cell_selector(ind_cells, n_p, N)*cvx.vec(X) == 0)
 
-    # Teacher constraints
+    # Gender, Teacher and Maturity constraints only apply to the slots with
+    # a demand bigger than one (the backup slots are left out).
+    gend_constr = []
     teach_constr = []
-    for s in range(n_d*n_s):
-        if demand[s] > 1:
-            teach_constr.append(T.reshape(1,n_p)*X[:,s] == 1)
-    
-    # Maturity constraints
     matur_constr = []
-    for s in range(n_d*n_s):
-        if demand[s] > 1:
-            matur_constr.append(M.reshape(1,n_p)*X[:,s] >= 1)
+    if demand is not None:
+        multi = np.flatnonzero(demand > 1)
+        if len(multi) > 0:
+            sel = column_selector(multi, N)
+            gend_constr.append(G.reshape(1, n_p)*X*sel
+                               <= prop*demand[multi].reshape(1, -1))
+            teach_constr.append(T.reshape(1, n_p)*X*sel == 1)
+            matur_constr.append(M.reshape(1, n_p)*X*sel >= 1)
 
     # No Repeat constraints
-    no_rep_constr = []
-    for d in range(n_d):
-        for p in range(n_p):
-            no_rep_constr.append(cvx.sum_entries(X[p, d*n_s:n_s*(d+1)]) <= 1)
+    no_rep_constr = [X*day_matrix(n_d, n_s) <= 1]
 
     # Slot (Activity) choice constraint
     slot_constr = []
-    for p in range(n_p):
-        for s in range(n_s):
-            slot_constr = slot_constr + [X[p, s + n_s*d] <= slot_choice[p, s] for d in range(n_d)]
+    if slot_choice is not None:
+        slot_constr.append(X <= np.tile(slot_choice, (1, n_d)))
 
     # Forced constraint
     force_constr = []
-    for p, d in forced:
-        force_constr.append(X[p,d] == 1)
+    if len(forced) > 0:
+        force_constr.append(cell_selector(forced, n_p, N)*cvx.vec(X) == 1)
 
     constraints = (demand_constr
                    + ind_constr
@@ -103,18 +305,313 @@ def solve(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand, prop=0.5,
                    )
 
     # Objective Function
-    obj = cvx.Minimize(cvx.max_entries(cvx.sum_entries(X, axis=1)))
+    load = cvx.sum_entries(X, axis=1)
+    if hist is not None:
+        load = load + np.reshape(hist, (n_p, 1))
+    obj = cvx.Minimize(cvx.max_entries(load))
 
     prob = cvx.Problem(obj, constraints)
-    prob.solve(solver=cvx.GLPK_MI)
-    sol = X.value
-    value = prob.value
-    if sol is not None:
-        # Gets rids of the residues, rounds everything to zero or one
-        sol = np.int8(sol.round(2))
-        value = int(round(value))
-
-    return prob.status, sol, value
+    stats.timings['build'] += time.time() - build_start
+    stats.n_variables = n_p*N if pre is None or not pre.free.any() \
+        else int(pre.free.sum())
+    stats.n_constraints = int(sum(np.prod(c.size) for c in constraints))
+
+    # The canonicalization is cached by cvxpy and reused by prob.solve
+    with stats.phase('canonicalization'):
+        prob.get_problem_data(getattr(cvx, solver))
+    # GLPK takes its time limit in milliseconds
+    glpk_options = {}
+    if time_limit is not None and solver == 'GLPK_MI':
+        glpk_options['tm_lim'] = int(time_limit*1000)
+    if mip_gap is not None and solver == 'GLPK_MI':
+        glpk_options['mip_gap'] = float(mip_gap)
+    with stats.phase('solver'):
+        prob.solve(solver=getattr(cvx, solver), **glpk_options)
+    solver_stats = getattr(prob, 'solver_stats', None)
+    if solver_stats is not None:
+        stats.iterations = getattr(solver_stats, 'num_iters', None)
+
+    with stats.phase('postprocess'):
+        sol = X.value
+        value = prob.value
+        if sol is not None:
+            # Gets rids of the residues, rounds everything to zero or one
+            sol = np.int8(sol.round(2))
+            value = int(round(value))
+            stats.mip_gap = 0.0 if prob.status == 'optimal' else None
+
+    return stats.done(prob.status, sol, value)
+
+
+class SolveStats(object):
+    """Phase timings, problem size and solver statistics of one solve.
+
+    timings holds the seconds spent on each of PHASES. The sizes are the
+    ones given to the solver, after presolve. iterations, nodes and mip_gap
+    are None when the backend doesn't report them.
+    """
+    PHASES = ['build', 'canonicalization', 'solver', 'postprocess']
+
+    def __init__(self):
+        self.backend = None
+        self.status = None
+        self.value = None
+        self.timings = dict((p, 0.0) for p in self.PHASES)
+        self.n_variables = None
+        self.n_constraints = None
+        self.iterations = None
+        self.nodes = None
+        self.mip_gap = None
+        self.objectives = None
+        self.conflicts = []
+        self.portfolio = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.time() - start
+
+    def done(self, status, sol, value):
+        """Records the outcome and passes the result of solve through."""
+        self.status = status
+        self.value = value
+        return status, sol, value
+
+    def to_dict(self):
+        return {'backend': self.backend, 'status': self.status,
+                'value': self.value, 'timings': dict(self.timings),
+                'total_time': sum(self.timings.values()),
+                'n_variables': self.n_variables,
+                'n_constraints': self.n_constraints,
+                'iterations': self.iterations, 'nodes': self.nodes,
+                'mip_gap': self.mip_gap, 'objectives': self.objectives,
+                'conflicts': [list(v) for v in self.conflicts],
+                'portfolio': self.portfolio}
+
+    def stamp(self):
+        """The statistics as a list of 'name: value' cells, for the stamp
+        row of write_sol.
+        """
+        cells = ['{}: {}'.format(k, self.to_dict()[k]) for k in
+                 ['backend', 'status', 'value', 'n_variables',
+                  'n_constraints', 'iterations', 'nodes', 'mip_gap']]
+        cells += ['{} time: {:.4f}s'.format(p, self.timings[p])
+                  for p in self.PHASES]
+        return cells
+
+    def log(self, path, **extra):
+        """Appends the statistics as one JSON line to the log file at path.
+        """
+        entry = self.to_dict()
+        entry['time'] = datetime.datetime.now().isoformat()
+        entry.update(extra)
+        with open(path, 'a') as log_file:
+            log_file.write(json.dumps(entry) + '\n')
+
+
+def reject_options(mode, **given):
+    """Raises a ValueError naming the options of solve that were given
+    (their value is True) but that mode can't honor."""
+    names = sorted(name for name, value in given.items() if value)
+    if names:
+        raise ValueError('Not available with {}: {}.'
+                         .format(mode, ', '.join(names)))
+
+
+def day_matrix(n_d, n_s):
+    """Sparse (n_d*n_s, n_d) matrix that sums the slots of each day, so
+    X*day_matrix(n_d, n_s) gives the number of slots of each person per day.
+    """
+    rows = np.arange(n_d*n_s)
+    return sp.csc_matrix((np.ones(n_d*n_s), (rows, rows // n_s)),
+                         shape=(n_d*n_s, n_d))
+
+
+def column_selector(cols, n_cols):
+    """Sparse (n_cols, len(cols)) matrix that picks the given columns of X
+    when multiplied on the right.
+    """
+    cols = np.asarray(cols, dtype=np.int64)
+    return sp.csc_matrix((np.ones(len(cols)), (cols, np.arange(len(cols)))),
+                         shape=(n_cols, len(cols)))
+
+
+def cell_selector(cells, n_p, n_cols):
+    """Sparse (len(cells), n_p*n_cols) matrix that picks the (person, column)
+    cells of X out of cvx.vec(X), which stacks X column by column.
+    """
+    cells = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+    idx = cells[:, 0] + n_p*cells[:, 1]
+    return sp.csr_matrix((np.ones(len(idx)), (np.arange(len(idx)), idx)),
+                         shape=(len(idx), n_p*n_cols))
+
+
+def indisp_cells(n_d, n_s, indisp):
+    """Expands the (person, day) indisponibilities into the (person,
+    day*n_s+slot) cells of X that have to be zero.
+    """
+    indisp = np.asarray(indisp, dtype=np.int64).reshape(-1, 2)
+    p = np.repeat(indisp[:, 0], n_s)
+    j = (indisp[:, 1].reshape(-1, 1)*n_s + np.arange(n_s)).reshape(-1)
+    return np.stack([p, j], axis=1)
+
+
+# Result of the presolve stage. free is a boolean (n_p, n_d*n_s) mask of the
+# cells that are still decision variables, fixed holds the value of every
+# other cell, and conflicts lists the (rule, person, column) tuples that
+# already make the instance infeasible (person is None for column rules).
+Presolved = namedtuple('Presolved', ['free', 'fixed', 'conflicts'])
+
+
+def run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+                 prop=0.5):
+    """Fixes every cell of X that is already decided by slot_choice, indisp
+    and forced, and propagates the forced assignments into the demand and
+    no-repeat rows.
+
+    Args:
+        Same as solve
+
+    Returns:
+        Presolved: The free mask, the fixed values and the conflicts found
+    """
+    N = n_d*n_s
+    avail = np.tile(np.asarray(slot_choice, dtype=bool), (1, n_d))
+    ind_cells = indisp_cells(n_d, n_s, indisp)
+    avail[ind_cells[:, 0], ind_cells[:, 1]] = False
+    ones = np.zeros((n_p, N), dtype=bool)
+    forced = np.asarray(forced, dtype=np.int64).reshape(-1, 2)
+    ones[forced[:, 0], forced[:, 1]] = True
+    conflicts = [('forced', p, j) for p, j in np.argwhere(ones & ~avail)]
+
+    # Someone forced on a day can't do any other slot on that same day
+    per_day = ones.reshape(n_p, n_d, n_s).sum(axis=2)
+    conflicts += [('no_repeat', p, d*n_s) for p, d in np.argwhere(per_day > 1)]
+    busy = np.repeat(per_day > 0, n_s, axis=1)
+    free = avail & ~ones & ~busy
+
+    fixed = np.int8(ones)
+    if demand is not None:
+        demand = np.asarray(demand).reshape(-1)
+        # Residual demand after the forced people, against the free cells
+        left = demand - ones.sum(axis=0)
+        n_free = free.sum(axis=0)
+        conflicts += [('demand', None, j)
+                      for j in np.flatnonzero((left < 0) | (left > n_free))]
+
+        # Each day needs as many different people as its total demand
+        day_avail = (free | ones).reshape(n_p, n_d, n_s).any(axis=2)
+        day_demand = demand.reshape(n_d, n_s).sum(axis=1)
+        conflicts += [('day_demand', None, d*n_s) for d in
+                      np.flatnonzero(day_avail.sum(axis=0) < day_demand)]
+
+        multi = demand > 1
+        G, T, M = [np.asarray(a, dtype=np.int64).reshape(-1) for a in (G, T, M)]
+        ones, free = np.int64(ones), np.int64(free)
+        both = ones + free
+        # Too many forced men, or not enough women to fill the rest
+        n_men = G.dot(ones)
+        n_women = demand - np.floor(prop*demand + 1e-9)
+        conflicts += [('gender', None, j) for j in np.flatnonzero(
+            multi & ((n_men > prop*demand) | ((1 - G).dot(both) < n_women)))]
+        # Exactly one teacher, so demand - 1 others
+        n_teach = T.dot(ones)
+        no_teach = (n_teach == 0) & (T.dot(free) == 0)
+        few_others = (1 - T).dot(both) < demand - 1
+        conflicts += [('teacher', None, j) for j in np.flatnonzero(
+            multi & ((n_teach > 1) | no_teach | few_others))]
+        no_matur = (M.dot(ones) == 0) & (M.dot(free) == 0)
+        conflicts += [('maturity', None, j)
+                      for j in np.flatnonzero(multi & no_matur)]
+
+    return Presolved(free.astype(bool), fixed, conflicts)
+
+
+def precheck(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+             prop=0.5, pre=None):
+    """Necessary conditions for feasibility, evaluated by counting on whole
+    arrays before any solver is called. They are the conflicts of
+    run_presolve: a forced cell that is not available, someone forced twice
+    on a day, a slot with more forced people than its demand or fewer
+    available people, a day that needs more people than are available, and
+    a slot with demand above one whose gender cap, teacher or mature person
+    can't be met.
+
+    Args:
+        Same as solve
+        pre (Presolved): The result of run_presolve, if already known
+
+    Returns:
+        list: One src.tests.Violation(rule, person, day, slot) per failed
+        condition, empty if none failed (which does not prove feasibility).
+        The slot is None for the day-wide rules 'no_repeat' and 'day_demand'
+    """
+    if pre is None:
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+    report = []
+    for rule, p, j in pre.conflicts:
+        slot = None if rule in ('no_repeat', 'day_demand') else int(j % n_s)
+        report.append(tt.Violation(rule, None if p is None else int(p),
+                                   int(j // n_s), slot))
+    return report
+
+
+def people_classes(n_p, n_d, G, T, M, indisp, forced, slot_choice,
+                   hist=None):
+    """Groups the interchangeable people: the same gender, teacher and
+    maturity, the same slot choice row, the same indisponible days and the
+    same past workload. The people with forced slots are kept alone.
+
+    Returns:
+        labels (ndarray): The (n_p) class of each person
+        reps (ndarray): The (n_c) first person of each class
+        sizes (ndarray): The (n_c) number of people of each class
+    """
+    days = np.zeros((n_p, n_d), dtype=np.int64)
+    indisp = np.asarray(indisp, dtype=np.int64).reshape(-1, 2)
+    days[indisp[:, 0], indisp[:, 1]] = 1
+    alone = np.zeros(n_p, dtype=np.int64)
+    forced = np.asarray(forced, dtype=np.int64).reshape(-1, 2)
+    alone[forced[:, 0]] = forced[:, 0] + 1
+    past = np.zeros(n_p) if hist is None else np.asarray(hist)
+    keys = np.column_stack([np.reshape(G, (n_p, 1)), np.reshape(T, (n_p, 1)),
+                            np.reshape(M, (n_p, 1)), slot_choice, days,
+                            past.reshape(n_p, 1), alone]).astype(np.int64)
+    _, reps, labels, sizes = np.unique(keys, axis=0, return_index=True,
+                                       return_inverse=True,
+                                       return_counts=True)
+    return labels.reshape(-1), reps, sizes
+
+
+def split_classes(Y, labels, n_d, n_s, hist=None):
+    """Hands the (n_c, n_d*n_s) assignment counts of the classes back to
+    their people. Every day the slots of a class go to its least loaded
+    people, one slot each, so the workloads within a class never differ by
+    more than one and the largest is ceil(total / size).
+
+    Returns:
+        ndarray: The (n_p, n_d*n_s) schedule
+    """
+    n_p = len(labels)
+    sol = np.zeros((n_p, n_d*n_s), dtype=np.int8)
+    load = np.zeros(n_p) if hist is None else np.array(hist, dtype=float)
+    for c in range(Y.shape[0]):
+        members = np.flatnonzero(labels == c)
+        for d in range(n_d):
+            counts = Y[c, d*n_s:(d+1)*n_s]
+            if counts.sum() == 0:
+                continue
+            order = members[np.argsort(load[members], kind='stable')]
+            slots = np.repeat(np.arange(n_s), counts)
+            chosen = order[:len(slots)]
+            sol[chosen, d*n_s + slots] = 1
+            load[chosen] += 1
+    return sol
+
 
 if __name__ == "__main__":
     n_p_ = 64
@@ -0,0 +1,136 @@
+import time
+import multiprocessing
+from queue import Empty
+
+
+# Entries raced by default. Each one is a name and options of
+# src.optim.solve; the ones whose backend is missing (e.g. cvxpy or CBC
+# not installed) just report an error and drop out of the race.
+DEFAULT_PORTFOLIO = [
+    {'name': 'heuristic', 'backend': 'heuristic'},
+    {'name': 'highs', 'backend': 'highs'},
+    {'name': 'highs_classes', 'backend': 'highs', 'aggregate': True},
+    {'name': 'glpk', 'backend': 'cvxpy', 'solver': 'GLPK_MI'},
+    {'name': 'cbc', 'backend': 'cvxpy', 'solver': 'CBC'},
+]
+# Share of the time limit of the race given to each entry, the rest is left
+# for starting its process, building its model and sending its schedule
+ENTRY_SHARE = 0.9
+# Seconds waited past the time limit for the entries that used their whole
+# budget, before they are cancelled
+GRACE = 2.
+
+
+def run_entry(optim_params, prop, hist, entry, deadline, mip_gap, results):
+    """Solves the instance with one entry of the portfolio, in its own
+    process, and puts (name, status, solution, value, stats) on results.
+    The solver of the entry stops at the deadline (a time.time() value) if
+    given, with its best schedule.
+    """
+    from src.optim import solve, SolveStats
+    options = dict(entry)
+    name = options.pop('name')
+    if deadline is not None:
+        left = max(deadline - time.time(), 0.)
+        if options.get('time_limit') is None or options['time_limit'] > left:
+            options['time_limit'] = left
+    if mip_gap is not None:
+        options.setdefault('mip_gap', mip_gap)
+    stats = SolveStats()
+    try:
+        status, sol, value = solve(*optim_params, prop=prop, hist=hist,
+                                   stats=stats, **options)
+    except Exception as e:
+        results.put((name, 'error: {!r}'.format(e), None, None, None))
+        return
+    results.put((name, status, sol, value, stats.to_dict()))
+
+
+def solve_portfolio(optim_params, prop=0.5, hist=None, portfolio=None,
+                    time_limit=None, mip_gap=None):
+    """Races the entries of a portfolio on the same instance, each one in
+    its own process. The first proven optimum wins and the other processes
+    are terminated. Otherwise, when every entry is done or the time limit
+    is reached, the best schedule found wins.
+
+    Args:
+        optim_params (tuple): The parameters returned by read_forms
+        prop (float): Maximum proportion of men in each slot
+        hist (ndarray): The past workload, see src.optim.solve
+        portfolio (list): Dicts with a name and the options of
+        src.optim.solve, DEFAULT_PORTFOLIO by default
+        time_limit (float): Deadline of the race in seconds. Each entry gets
+        ENTRY_SHARE of it, and the race waits GRACE more seconds for their
+        schedules
+        mip_gap (float): Relative gap given to every entry
+
+    Returns:
+        status (str): 'optimal' if some entry proved its schedule optimal,
+        'infeasible' if some entry proved there is none, 'optimal_inaccurate'
+        if only unproven schedules were found, and the status of the last
+        entry otherwise
+        solution (ndarray): The winning schedule, or None
+        value (int): Its maximum workload
+        records (list): One dict per entry, with its name, status, value,
+        wall time, statistics, and whether it won. Entries that were
+        terminated have the status 'cancelled'
+    """
+    portfolio = portfolio or DEFAULT_PORTFOLIO
+    start = time.time()
+    deadline = None
+    if time_limit is not None:
+        deadline = start + ENTRY_SHARE*time_limit
+    results = multiprocessing.Queue()
+    procs = {}
+    for entry in portfolio:
+        proc = multiprocessing.Process(
+            target=run_entry, args=(optim_params, prop, hist, entry,
+                                    deadline, mip_gap, results))
+        proc.start()
+        procs[entry['name']] = proc
+
+    records = {}
+    best = None
+    status = 'solver_error'
+    while len(records) < len(procs):
+        wait = None
+        if time_limit is not None:
+            wait = time_limit + GRACE - (time.time() - start)
+            if wait <= 0:
+                break
+        try:
+            name, e_status, sol, value, e_stats = results.get(timeout=wait)
+        except Empty:
+            break
+        records[name] = {'name': name, 'status': e_status, 'value': value,
+                         'time': time.time() - start, 'stats': e_stats,
+                         'winner': False}
+        if sol is not None and (best is None or value < best[2]
+                                or e_status == 'optimal'):
+            best = (name, sol, value)
+        if sol is not None and e_status == 'optimal':
+            status = 'optimal'
+            break
+        if e_status == 'infeasible':
+            # A proof as good as an optimum, nothing else can do better
+            status = 'infeasible'
+            break
+        if sol is None and best is None:
+            status = e_status
+
+    for name, proc in procs.items():
+        if proc.is_alive():
+            proc.terminate()
+        proc.join()
+        if name not in records:
+            records[name] = {'name': name, 'status': 'cancelled',
+                             'value': None, 'time': time.time() - start,
+                             'stats': None, 'winner': False}
+    records = [records[e['name']] for e in portfolio]
+    if best is None or status == 'infeasible':
+        return status, None, None, records
+    for rec in records:
+        rec['winner'] = rec['name'] == best[0]
+    if status != 'optimal':
+        status = 'optimal_inaccurate'
+    return status, best[1], best[2], records
@@ -0,0 +1,125 @@
+import numpy as np
+from src.optim import run_presolve, Presolved
+from src.milp import build_milp, run_milp, milp_options, workload
+from src.tests import validate
+
+
+def broken_days(sol, optim_params, prop=0.5):
+    """The days in which the published schedule breaks some rule of the
+    updated parameters, e.g. someone who became indisponible or a new
+    forced slot.
+    """
+    report = validate(sol, optim_params, prop=prop)[1]
+    return sorted(set(v.day for v in report))
+
+
+def neighborhood(sol, optim_params, days, pre, n_substitutes=None,
+                 hist=None):
+    """The (n_p, n_d*n_s) mask of the cells that the repair may change: the
+    slots of the given days, for the people working or forced on them and
+    for at most n_substitutes others, the least loaded of the ones with a
+    free cell (see run_presolve) in those slots first (everyone if
+    n_substitutes is None).
+    """
+    n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand = optim_params
+    cols = (np.reshape(days, (-1, 1))*n_s + np.arange(n_s)).reshape(-1)
+    people = np.zeros(n_p, dtype=bool)
+    if n_substitutes is None:
+        people[:] = True
+    else:
+        people |= sol[:, cols].any(axis=1)
+        forced = np.asarray(forced, dtype=np.int64).reshape(-1, 2)
+        people[forced[np.isin(forced[:, 1], cols), 0]] = True
+        load = sol.sum(axis=1) + (0 if hist is None else np.asarray(hist))
+        avail = pre.free[:, cols].any(axis=1) & ~people
+        others = np.flatnonzero(avail)
+        others = others[np.argsort(load[others], kind='stable')]
+        people[others[:n_substitutes]] = True
+    mask = np.zeros(sol.shape, dtype=bool)
+    mask[np.ix_(people, cols)] = True
+    return mask
+
+
+def repair(optim_params, sol, new_indisp=(), new_forced=(), prop=0.5,
+           hist=None, max_workload=None, n_substitutes=8, time_limit=None,
+           days=None, max_days=None):
+    """Fixes a published schedule after new indisponibilities or forced
+    slots, changing as few assignments as possible.
+
+    Only the days that the changes break are reopened, and in them only the
+    people already working, the newly forced ones and n_substitutes others.
+    Every other cell keeps its published value. The MILP of build_milp then
+    minimizes the number of changed cells, with the maximum workload capped.
+    If the neighborhood is too small, it is retried with everyone free on
+    those days, and then with their neighbors reopened too, 1, 2, 4... days
+    on each side, until the whole schedule is.
+
+    Args:
+        optim_params (tuple): The parameters the schedule was solved with
+        sol (ndarray): The published (n_p, n_d*n_s) schedule
+        new_indisp (list): New (person, day) indisponibilities
+        new_forced (list): New (person, day*n_s+slot) forced entries
+        prop (float): Maximum proportion of men in each slot
+        hist (ndarray): The past workload, see src.optim.solve
+        max_workload (int): Cap on the maximum workload, the one of sol by
+        default
+        n_substitutes (int): Number of people not working on the reopened
+        days that may be called in
+        time_limit (float): Wall-clock budget of each solver call, in seconds
+        days (list): The days to reopen, the ones the changes break by
+        default
+        max_days (int): Most days reopened by the widening, all by default
+
+    Returns:
+        status (str): The status of the repair, 'optimal' when the schedule
+        needed no change. 'infeasible' is only returned when the whole
+        schedule was reopened for everyone, a proof that no schedule meets
+        the cap, and 'not_found' when the search stopped before that
+        solution (ndarray): The repaired schedule, or None
+        changes (list): The (person, day*n_s+slot) cells that changed
+    """
+    n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand = optim_params
+    params = (n_p, n_d, n_s, G, T, M, list(indisp) + list(new_indisp),
+              list(forced) + list(new_forced), slot_choice, demand)
+    sol = np.int8(sol)
+    if days is None:
+        days = broken_days(sol, params, prop)
+    if len(days) == 0:
+        return 'optimal', sol, []
+    if max_workload is None:
+        max_workload = int(workload(sol, hist))
+
+    pre = run_presolve(*params, prop=prop)
+    if len(pre.conflicts) > 0:
+        return 'infeasible', None, []
+    c, A, a_lo, a_hi, lb, ub, integrality = build_milp(*params, prop=prop,
+                                                       hist=hist)
+    ub[-1] = max_workload
+    # Changed cells: x on the cells that were 0 and 1 - x on the others
+    c[:-1] = 1 - 2*sol.reshape(-1)
+    c[-1] = 0
+
+    tries = [n_substitutes, None] if n_substitutes is not None else [None]
+    width = 0
+    while True:
+        reopened = sorted(set(np.clip(np.add.outer(days, np.arange(
+            -width, width + 1)).reshape(-1), 0, n_d - 1).tolist()))
+        if width > 0 and max_days is not None and len(reopened) > max_days:
+            return 'not_found', None, []
+        for k in tries:
+            mask = neighborhood(sol, params, reopened, pre, k, hist)
+            free = mask & pre.free
+            fixed = np.where(mask, pre.fixed, sol).astype(np.int8)
+            status, x, res = run_milp(c, A, a_lo, a_hi, lb, ub, integrality,
+                                      pre=Presolved(free, fixed, []),
+                                      options=milp_options(time_limit))
+            if x is not None:
+                new = np.int8(x[:-1].round().reshape(n_p, n_d*n_s))
+                changes = [tuple(e) for e in np.argwhere(new != sol).tolist()]
+                return status, new, changes
+            if status != 'infeasible':
+                # Out of time, nothing is proven
+                return 'not_found', None, []
+        if len(reopened) == n_d:
+            return status, None, []
+        width = max(2*width, 1)
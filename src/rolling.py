@@ -0,0 +1,105 @@
+import numpy as np
+from src.optim import solve, run_presolve, Presolved
+from src.heuristic import greedy
+
+
+def window_instance(optim_params, start, length):
+    """Extracts the days [start, start + length) of an instance.
+
+    Args:
+        optim_params (tuple): (n_p, n_d, n_s, G, T, M, indisp, forced,
+        slot_choice, demand), as returned by read_forms
+
+    Returns:
+        tuple: The optim_params of the window, with the days renumbered from 0
+    """
+    n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand = optim_params
+    end = start + length
+    w_indisp = [(p, d - start) for p, d in indisp if start <= d < end]
+    w_forced = [(p, j - start*n_s) for p, j in forced
+                if start*n_s <= j < end*n_s]
+    w_demand = np.asarray(demand).reshape(-1)[start*n_s:end*n_s]
+    return (n_p, length, n_s, G, T, M, w_indisp, w_forced, slot_choice,
+            w_demand)
+
+
+def overlap_incumbent(params, overlap, prop=0.5, hist=None):
+    """Builds a starting schedule for a window that keeps the assignments of
+    the days it shares with the previous window and fills the new days
+    greedily, counting the past workload.
+
+    Args:
+        params (tuple): The optim_params of the window
+        overlap (ndarray): The (n_p, k*n_s) assignment of its first k days
+
+    Returns:
+        ndarray: The (n_p, n_d*n_s) schedule of the window, or None
+    """
+    n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand = params
+    pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                       demand, prop)
+    if len(pre.conflicts) > 0:
+        return None
+    k = overlap.shape[1]
+    fixed, free = pre.fixed.copy(), pre.free.copy()
+    fixed[:, :k] = overlap
+    free[:, :k] = False
+    G, T, M = [np.asarray(a, dtype=np.int64).reshape(-1) for a in (G, T, M)]
+    return greedy(n_p, n_d, n_s, G, T, M, Presolved(free, fixed, []),
+                  np.asarray(demand).reshape(-1), prop, hist)
+
+
+def solve_rolling(optim_params, window, commit, prop=0.5, hist=None,
+                  backend='highs', **options):
+    """Builds a long schedule (e.g. a year) one window of days at a time.
+
+    Each window is solved with the workload accumulated so far as hist, so
+    the min-max objective keeps the fairness across windows. Only its first
+    commit days are kept, the next window starts right after them and is
+    warm-started with the assignments of the days the two windows share.
+    The memory and time of each solve are bounded by the window size.
+
+    Args:
+        optim_params (tuple): The parameters returned by read_forms
+        window (int): Number of days solved at once
+        commit (int): Number of days kept from each window, at most window
+        prop (float): Maximum proportion of men in each slot
+        hist (ndarray): The (n_p) workload from before the first day
+        backend (str): The backend of src.optim.solve used on each window
+        **options: Other options of src.optim.solve
+
+    Returns:
+        Same as src.optim.solve, (status, solution, value), where value is
+        the maximum total workload, hist included. The status is
+        'optimal_inaccurate' when more than one window was needed, since the
+        horizon as a whole is not proven optimal.
+    """
+    n_p, n_d, n_s = optim_params[:3]
+    if not 0 < commit <= window:
+        raise ValueError('commit must be between 1 and window.')
+    past = np.zeros(n_p, dtype=np.int64)
+    if hist is not None:
+        past = past + np.asarray(hist, dtype=np.int64).reshape(n_p)
+    sol = np.zeros((n_p, n_d*n_s), dtype=np.int8)
+    overlap = np.zeros((n_p, 0), dtype=np.int8)
+    start = 0
+    status = 'optimal'
+    while start < n_d:
+        length = min(window, n_d - start)
+        params = window_instance(optim_params, start, length)
+        incumbent = overlap_incumbent(params, overlap, prop, past)
+        w_status, w_sol, w_value = solve(*params, prop=prop, hist=past,
+                                         backend=backend,
+                                         incumbent=incumbent, **options)
+        if w_sol is None:
+            return w_status, None, None
+        if w_status != 'optimal':
+            status = w_status
+        keep = length if start + length >= n_d else commit
+        sol[:, start*n_s:(start+keep)*n_s] = w_sol[:, :keep*n_s]
+        past = past + w_sol[:, :keep*n_s].sum(axis=1)
+        overlap = w_sol[:, keep*n_s:]
+        start += keep
+    if window < n_d and status == 'optimal':
+        status = 'optimal_inaccurate'
+    return status, sol, int(past.max())
@@ -0,0 +1,246 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Protocol: newline delimited JSON over a local TCP socket. The client sends
+# one job per line, the service answers with one update per line:
+#   {"id": ..., "status": "queued"}
+#   {"id": ..., "status": "running"}
+#   {"id": ..., "status": "done", "result": {...}}
+# or a last update with the status "timeout", "rejected" or "error". The
+# updates of different jobs of the same connection may interleave.
+#
+# A job is a dict with one source of the instance:
+#   "snapshot": the path of an instance snapshot (see src.snapshot)
+#   "forms": a project root with the data folder (see read_forms)
+#   "instance": a dict with n_p, n_d, n_s, G, T, M, indisp, forced,
+#   slot_choice and demand
+# and optionally "id", "scenario" (overrides and solver options, see
+# src.batch.apply_scenario) and "timeout" in seconds, the best schedule
+# found by then is sent back.
+HOST = '127.0.0.1'
+PORT = 8765
+# Longest line, a job or an update with a whole instance or schedule
+LIMIT = 2**30
+# Share of the timeout of a job given to the solver, the rest is left for
+# building the model and sending the schedule back
+SOLVER_SHARE = 0.9
+# Seconds waited past the timeout for the best schedule of the solver
+# before the job is reported as "timeout"
+GRACE = 5.
+
+
+def init_worker():
+    """Imports the solver stack once per worker process."""
+    import src.optim
+    import src.milp
+    import src.batch
+    try:
+        # src.optim only imports cvxpy when its backend, the default one,
+        # runs. Loaded here so the first job does not pay for it
+        import cvxpy  # noqa: F401
+    except ImportError:
+        pass
+
+
+def load_instance(job):
+    """Returns the optim_params of the instance described by a job."""
+    if 'snapshot' in job:
+        from src.snapshot import load_snapshot
+        return load_snapshot(job['snapshot'])[0]
+    if 'forms' in job:
+        from src.exchange_data import read_forms
+        return read_forms(job['forms'])[0]
+    if 'instance' in job:
+        inst = job['instance']
+        return tuple(inst[k] for k in ['n_p', 'n_d', 'n_s', 'G', 'T', 'M',
+                                       'indisp', 'forced', 'slot_choice',
+                                       'demand'])
+    raise ValueError('The job has no "snapshot", "forms" or "instance".')
+
+
+def run_job(job):
+    """Solves one job, in a worker process.
+
+    Returns:
+        dict: status, value, solution (as nested lists) and the statistics
+        of the solve
+    """
+    from src.optim import solve, SolveStats
+    from src.batch import apply_scenario
+    optim_params, prop, options = apply_scenario(load_instance(job),
+                                                 job.get('scenario', {}))
+    if job.get('deadline') is not None:
+        # The solver stops itself before the job times out, and the best
+        # schedule found so far is returned
+        left = max(job['deadline'] - time.time(), 0.)
+        if options.get('time_limit') is None or options['time_limit'] > left:
+            options['time_limit'] = left
+    stats = SolveStats()
+    status, sol, value = solve(*optim_params, prop=prop, stats=stats,
+                               **options)
+    return {'status': status, 'value': value,
+            'solution': None if sol is None else sol.tolist(),
+            'stats': stats.to_dict()}
+
+
+class SchedulingService(object):
+    """Local scheduling service. The solver stack is loaded once per worker
+    process, and the jobs of every connection go through one queue.
+
+    At most max_concurrent jobs run at the same time, at most queue_size
+    wait in the queue (the others are rejected). The solver of a job with a
+    timeout (or the default one) gets SOLVER_SHARE of it and returns its
+    best schedule, and a job still running GRACE seconds after its timeout
+    is reported as "timeout". Its worker can't be interrupted, so it still
+    counts as running until it ends.
+    """
+
+    def __init__(self, processes=None, max_concurrent=2, queue_size=64,
+                 timeout=None):
+        self.processes = processes
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.pool = None
+        self.server = None
+        self.runners = []
+        self.n_jobs = 0
+
+    async def start(self, host=HOST, port=PORT):
+        self.pool = ProcessPoolExecutor(max_workers=self.processes,
+                                        initializer=init_worker)
+        # Starts the workers now, so the solver stack is loaded before the
+        # first job, and so forked workers don't inherit client sockets
+        await asyncio.get_running_loop().run_in_executor(self.pool,
+                                                         init_worker)
+        self.runners = [asyncio.ensure_future(self.runner())
+                        for i in range(self.max_concurrent)]
+        self.server = await asyncio.start_server(self.handle, host, port,
+                                                 limit=LIMIT)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for r in self.runners:
+            r.cancel()
+        await asyncio.gather(*self.runners, return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def runner(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, send, finished = await self.queue.get()
+            try:
+                send(job, {'status': 'running'})
+                timeout = job.get('timeout', self.timeout)
+                start = time.time()
+                if timeout is not None:
+                    job['timeout'] = timeout
+                    job['deadline'] = start + SOLVER_SHARE*timeout
+                    timeout += GRACE
+                future = loop.run_in_executor(self.pool, run_job, job)
+                try:
+                    result = await asyncio.wait_for(asyncio.shield(future),
+                                                    timeout)
+                except asyncio.TimeoutError:
+                    send(job, {'status': 'timeout'})
+                    finished.set()
+                    # Keeps the slot of the job until its worker is free
+                    await asyncio.gather(future, return_exceptions=True)
+                except Exception as e:
+                    send(job, {'status': 'error', 'error': repr(e)})
+                else:
+                    send(job, {'status': 'done', 'result': result,
+                               'time': time.time() - start})
+            finally:
+                finished.set()
+                self.queue.task_done()
+
+    async def handle(self, reader, writer):
+        def send(job, update):
+            update['id'] = job.get('id')
+            if not writer.is_closing():
+                writer.write((json.dumps(update) + '\n').encode('utf-8'))
+
+        pending = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                job = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                send({}, {'status': 'error', 'error': repr(e)})
+                continue
+            self.n_jobs += 1
+            job.setdefault('id', self.n_jobs)
+            finished = asyncio.Event()
+            try:
+                self.queue.put_nowait((job, send, finished))
+            except asyncio.QueueFull:
+                send(job, {'status': 'rejected'})
+                continue
+            send(job, {'status': 'queued'})
+            pending.append(finished.wait())
+        # The client closed its side, waits for its jobs before hanging up
+        await asyncio.gather(*pending)
+        await writer.drain()
+        writer.close()
+
+
+async def submit(jobs, host=HOST, port=PORT):
+    """Sends jobs to a running service and yields their updates until all
+    of them are finished.
+    """
+    reader, writer = await asyncio.open_connection(host, port, limit=LIMIT)
+    for job in jobs:
+        writer.write((json.dumps(job) + '\n').encode('utf-8'))
+    await writer.drain()
+    writer.write_eof()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        yield json.loads(line.decode('utf-8'))
+    writer.close()
+
+
+async def serve(host=HOST, port=PORT, **options):
+    service = SchedulingService(**options)
+    address = await service.start(host, port)
+    print('Listening on {}:{}'.format(*address))
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Serves scheduling jobs over a local socket.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of workers, one per core by default')
+    parser.add_argument('--max-concurrent', type=int, default=2,
+                        help='Number of jobs solved at the same time')
+    parser.add_argument('--queue-size', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Default time limit of a job, in seconds')
+    args = parser.parse_args(argv[1:])
+    try:
+        asyncio.run(serve(args.host, args.port, processes=args.processes,
+                          max_concurrent=args.max_concurrent,
+                          queue_size=args.queue_size, timeout=args.timeout))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,105 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ProcessPoolExecutor
+from src.optim import run_presolve
+
+
+def components(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand,
+               prop=0.5, pre=None):
+    """Connected components of the graph between the people and the
+    columns (day*n_s+slot) they are available for, after slot_choice,
+    indisp and forced. Two components share no person and no column, so
+    they share no constraint either.
+
+    Args:
+        Same as src.optim.solve
+        pre (Presolved): The result of run_presolve, if already known
+
+    Returns:
+        list: (people, columns) index arrays of the components that have
+        some demand, largest first
+    """
+    if pre is None:
+        pre = run_presolve(n_p, n_d, n_s, G, T, M, indisp, forced,
+                           slot_choice, demand, prop)
+    avail = sp.csr_matrix(pre.free | (pre.fixed == 1))
+    graph = sp.bmat([[None, avail], [avail.T, None]], format='csr')
+    labels = connected_components(graph, directed=False)[1]
+    people, cols = labels[:n_p], labels[n_p:]
+    busy = np.asarray(demand).reshape(-1) > 0
+    shards = []
+    for k in np.unique(cols[busy]):
+        shards.append((np.flatnonzero(people == k), np.flatnonzero(cols == k)))
+    shards.sort(key=lambda s: -len(s[0])*len(s[1]))
+    return shards
+
+
+def shard_instance(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                   demand, people, cols):
+    """The instance of one component: its people, and the demand of its
+    columns only (the other columns are out of reach of its people).
+    """
+    pos = -np.ones(n_p, dtype=np.int64)
+    pos[people] = np.arange(len(people))
+    s_indisp = [(int(pos[p]), d) for p, d in indisp if pos[p] >= 0]
+    s_forced = [(int(pos[p]), j) for p, j in forced if pos[p] >= 0]
+    s_demand = np.zeros(n_d*n_s, dtype=np.asarray(demand).dtype)
+    s_demand[cols] = np.asarray(demand).reshape(-1)[cols]
+    return (len(people), n_d, n_s, np.asarray(G)[people],
+            np.asarray(T)[people], np.asarray(M)[people], s_indisp, s_forced,
+            np.asarray(slot_choice)[people], s_demand)
+
+
+def solve_shard(args):
+    params, prop, hist, options = args
+    from src.optim import solve
+    return solve(*params, prop=prop, hist=hist, **options)
+
+
+def solve_sharded(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                  demand, prop=0.5, hist=None, processes=None, pre=None,
+                  **options):
+    """Splits the instance in its independent components (see components),
+    solves them in a process pool and merges the schedules.
+
+    The objective needs no coordination between the components: the
+    maximum workload of the merged schedule is the largest of the maxima
+    of the components, and each of them is minimized, so the merged
+    schedule is optimal when every component is.
+
+    Args:
+        Same as src.optim.solve
+        processes (int): Number of worker processes, None for one per core
+        and 0 to solve the components in this process
+        pre (Presolved): The result of run_presolve, if already known
+        **options: Options of src.optim.solve for each component, e.g.
+        backend
+
+    Returns:
+        Same as src.optim.solve, (status, solution, value)
+    """
+    shards = components(n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+                        demand, prop, pre)
+    past = np.zeros(n_p) if hist is None else np.asarray(hist)
+    tasks = []
+    for people, cols in shards:
+        params = shard_instance(n_p, n_d, n_s, G, T, M, indisp, forced,
+                                slot_choice, demand, people, cols)
+        tasks.append((params, prop, None if hist is None else past[people],
+                      options))
+    if processes == 0 or len(tasks) <= 1:
+        results = [solve_shard(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(solve_shard, tasks))
+
+    sol = np.zeros((n_p, n_d*n_s), dtype=np.int8)
+    statuses = set()
+    for (people, cols), (status, s_sol, value) in zip(shards, results):
+        if s_sol is None:
+            return status, None, None
+        sol[people] = s_sol
+        statuses.add(status)
+    status = 'optimal' if statuses <= {'optimal'} else 'optimal_inaccurate'
+    return status, sol, int((sol.sum(axis=1) + past).max())
@@ -0,0 +1,100 @@
+import json
+import struct
+import numpy as np
+
+
+# Layout of a snapshot file:
+#   MAGIC (8 bytes) | version (uint32) | header length (uint32) | JSON header
+#   | the arrays, raw and C ordered, each one starting at a multiple of ALIGN
+# The header holds the sizes, the names, slot_names and days, and the dtype,
+# shape and offset of every array, so they can be memory-mapped in place.
+MAGIC = b'SCHEDSNP'
+VERSION = 1
+ALIGN = 64
+PREFIX = struct.Struct('<8sII')
+
+ARRAYS = ['G', 'T', 'K', 'indisp', 'forced', 'slot_choice', 'demand']
+
+
+def save_snapshot(path, optim_params, names, slot_names, days):
+    """Saves the output of read_forms as a binary snapshot.
+
+    Args:
+        path (str): Where to write the snapshot
+        optim_params (tuple): (n_p, n_d, n_s, G, T, K, indisp, forced,
+        slot_choice, demand), as returned by read_forms
+        names (list): The names of the people
+        slot_names (list): The names of the slots
+        days (list): The names of the days
+    """
+    n_p, n_d, n_s, G, T, K, indisp, forced, slot_choice, demand = optim_params
+    arrays = dict(G=G, T=T, K=K, slot_choice=slot_choice, demand=demand,
+                  indisp=np.asarray(indisp, dtype=np.int32).reshape(-1, 2),
+                  forced=np.asarray(forced, dtype=np.int32).reshape(-1, 2))
+    arrays = dict((k, np.ascontiguousarray(v)) for k, v in arrays.items())
+
+    # The offsets depend on the header length, so the header is sized with
+    # placeholder offsets first and padded to a fixed length.
+    header = {'n_p': int(n_p), 'n_d': int(n_d), 'n_s': int(n_s),
+              'names': list(names), 'slot_names': list(slot_names),
+              'days': list(days), 'arrays': {}}
+    layout = dict((k, {'dtype': arrays[k].dtype.str,
+                       'shape': list(arrays[k].shape), 'offset': 0})
+                  for k in ARRAYS)
+    header['arrays'] = layout
+    size = len(json.dumps(header).encode('utf-8')) + 32*len(ARRAYS)
+    offset = -(-(PREFIX.size + size) // ALIGN) * ALIGN
+    for k in ARRAYS:
+        layout[k]['offset'] = offset
+        offset += -(-arrays[k].nbytes // ALIGN) * ALIGN
+    raw = json.dumps(header).encode('utf-8')
+    raw += b' ' * (size - len(raw))
+
+    with open(path, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, VERSION, len(raw)))
+        f.write(raw)
+        for k in ARRAYS:
+            f.write(b'\0' * (layout[k]['offset'] - f.tell()))
+            f.write(arrays[k].tobytes())
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic, version, size = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not an instance snapshot.'.format(path))
+        if version > VERSION:
+            raise ValueError('{} is a version {} snapshot, this code only '
+                             'reads up to version {}.'
+                             .format(path, version, VERSION))
+        return json.loads(f.read(size).decode('utf-8'))
+
+
+def load_snapshot(path, mmap=True):
+    """Loads a snapshot written by save_snapshot. The arrays are read-only
+    memory maps of the file unless mmap is False.
+
+    Returns:
+        Same as read_forms, (optim_params, names, slot_names, days)
+    """
+    header = read_header(path)
+    arrays = {}
+    for k in ARRAYS:
+        spec = header['arrays'][k]
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[k] = np.zeros(shape, dtype=dtype)
+        elif mmap:
+            arrays[k] = np.memmap(path, dtype=dtype, mode='r',
+                                  offset=spec['offset'], shape=shape)
+        else:
+            with open(path, 'rb') as f:
+                f.seek(spec['offset'])
+                arrays[k] = np.fromfile(f, dtype=dtype,
+                                        count=int(np.prod(shape))).reshape(shape)
+    indisp = [tuple(e) for e in arrays['indisp'].tolist()]
+    forced = [tuple(e) for e in arrays['forced'].tolist()]
+    optim_params = (header['n_p'], header['n_d'], header['n_s'], arrays['G'],
+                    arrays['T'], arrays['K'], indisp, forced,
+                    arrays['slot_choice'], arrays['demand'])
+    return optim_params, header['names'], header['slot_names'], header['days']
@@ -1,5 +1,6 @@
 import numpy as np
 from random import randint
+from collections import namedtuple
 
 def test_indisp(n_p, n_d, n_s, sol, indisp):
     """Tests a solution to check if all the indisponibilities are respected.
@@ -23,12 +24,9 @@ def test_indisp(n_p, n_d, n_s, sol, indisp):
     assert sol.shape == (n_p, n_d*n_s), ("The informed dimensions are not" +
         "consistent with the given solution. Informed dimensions were, " +
         "n_p: {}, n_d: {}, n_s: {}".format(n_p,n_d,n_s))
-    passed = True
-    for p, d in indisp:
-        for i in range(n_s):
-            if sol[p, n_s*d + i] != 0:
-                passed = False   
-    return passed
+    indisp = np.asarray(indisp, dtype=np.int64).reshape(-1, 2)
+    days = sol.reshape(n_p, n_d, n_s)[indisp[:, 0], indisp[:, 1]]
+    return not np.any(days != 0)
 
 def test_gender(n_p, n_d, n_s, sol, gender, demand, prop):
     """Tests a solution to check if the max limit of men is respected.
@@ -56,17 +54,12 @@ def test_gender(n_p, n_d, n_s, sol, gender, demand, prop):
         "consistent with the given solution. Informed dimensions were, " +
         "n_p: {}, n_d: {}, n_s: {}".format(n_p,n_d,n_s))
     assert gender.shape == (n_p,), ("The given gender vector does not has the " +
-        "correct shape, needed {}, got {}".format((n_p,), gend.shape))
+        "correct shape, needed {}, got {}".format((n_p,), gender.shape))
     assert demand.shape == (n_d*n_s,), ("The given demand vector does not has the " +
         "correct shape, needed {}, got {}".format((n_d*n_s,), demand.shape))
-    passed = True
-    inst_fail = []
-
-    for s in range(n_d*n_s):
-        n_men = np.dot(sol[:, s].reshape(1,-1), gender.reshape(-1,1)).squeeze()
-        if n_men > prop * demand[s] and demand[s] > 1:
-            passed = False
-            inst_fail.append(s)
+    n_men = np.dot(gender.reshape(1,-1), sol).reshape(-1)
+    inst_fail = np.flatnonzero((n_men > prop * demand) & (demand > 1)).tolist()
+    passed = len(inst_fail) == 0
 
     # Question: Return or not the fail instances?
     return passed, inst_fail
@@ -94,14 +87,8 @@ def test_demand(n_p, n_d, n_s, sol, demand):
         "n_p: {}, n_d: {}, n_s: {}".format(n_p,n_d,n_s))
     assert demand.shape == (n_d*n_s,), ("The given demand vector does not has the " +
         "correct shape, needed {}, got {}".format((n_d*n_s,), demand.shape))
-    passed = True
-    inst_fail = []
-
-    for s in range(n_d*n_s):
-        total_pers = np.sum(sol[:, s])
-        if total_pers != demand[s]:
-            passed = False
-            inst_fail.append(s)
+    inst_fail = np.flatnonzero(np.sum(sol, axis=0) != demand).tolist()
+    passed = len(inst_fail) == 0
 
     # Question: Return or not the fail instances?
     return passed, inst_fail
@@ -128,15 +115,9 @@ def test_not_repeated(n_p, n_d, n_s, sol):
     assert sol.shape == (n_p, n_d*n_s), ("The informed dimensions are not" +
         "consistent with the given solution. Informed dimensions were, " +
         "n_p: {}, n_d: {}, n_s: {}".format(n_p,n_d,n_s))
-    passed = True
-    inst_fail = []
-
-    for d in range(n_d):
-        total_work = np.sum(sol[:, d*n_s:n_s*(d+1)], axis=1)
-        for p in range(n_p):
-            if total_work[p] > 1:
-                passed = False
-                inst_fail.append((p, d))
+    total_work = np.sum(sol.reshape(n_p, n_d, n_s), axis=2)
+    inst_fail = [tuple(e) for e in np.argwhere(total_work > 1).tolist()]
+    passed = len(inst_fail) == 0
 
     # Question: Return or not the fail instances?
     return passed, inst_fail
@@ -169,14 +150,9 @@ def test_maturity(n_p, n_d, n_s, sol, matur, demand):
         "correct shape, needed {}, got {}".format((n_p,), matur.shape))
     assert demand.shape == (n_d*n_s,), ("The given demand vector does not has the " +
         "correct shape, needed {}, got {}".format((n_d*n_s,), demand.shape))
-    passed = True
-    inst_fail = []
-
-    for s in range(n_d*n_s):
-        n_mature = np.dot(sol[:, s].reshape(1,-1), matur.reshape(-1,1)).squeeze()
-        if n_mature == 0 and demand[s] > 1:
-            passed = False
-            inst_fail.append(s)
+    n_mature = np.dot(matur.reshape(1,-1), sol).reshape(-1)
+    inst_fail = np.flatnonzero((n_mature == 0) & (demand > 1)).tolist()
+    passed = len(inst_fail) == 0
 
     # Question: Return or not the fail instances?
     return passed, inst_fail
@@ -210,14 +186,10 @@ def test_teacher(n_p, n_d, n_s, sol, teach, demand, max_teach=1):
         "correct shape, needed {}, got {}".format((n_p,), teach.shape))
     assert demand.shape == (n_d*n_s,), ("The given demand vector does not has the " +
         "correct shape, needed {}, got {}".format((n_d*n_s,), demand.shape))
-    passed = True
-    inst_fail = []
-
-    for s in range(n_d*n_s):
-        n_teach = np.dot(sol[:, s].reshape(1,-1), teach.reshape(-1,1)).squeeze()
-        if (n_teach == 0 or n_teach > max_teach) and demand[s] > 1:
-            passed = False
-            inst_fail.append(s)
+    n_teach = np.dot(teach.reshape(1,-1), sol).reshape(-1)
+    inst_fail = np.flatnonzero(((n_teach == 0) | (n_teach > max_teach))
+                              & (demand > 1)).tolist()
+    passed = len(inst_fail) == 0
 
     # Question: Return or not the fail instances?
     return passed, inst_fail
@@ -251,16 +223,11 @@ def test_slot_choice(n_p, n_d, n_s, sol, slot_choice):
     assert slot_choice.shape == (n_p, n_s), ("The informed dimensions are not" +
         "consistent with the given solution. Matrix was ({}) expected ({},{}) "
         .format(slot_choice.shape,n_p,n_s))
-    passed = True
-    inst_fail = []
-
-    for d in range(n_d):
-        for p in range(n_p):
-            chx_vec = slot_choice[p, :]
-            diff_vec = np.int16(chx_vec.reshape(-1)) - np.int16(sol[p, d*n_s:n_s*(d+1)].reshape(-1))
-            if -1 in diff_vec:
-                passed = False
-                inst_fail.append((p, d))
+    diff = (np.int16(slot_choice).reshape(n_p, 1, n_s)
+            - np.int16(sol).reshape(n_p, n_d, n_s))
+    inst_fail = [tuple(e) for e in
+                 np.argwhere(np.any(diff == -1, axis=2)).tolist()]
+    passed = len(inst_fail) == 0
 
     # Question: Return or not the fail instances?
     return passed, inst_fail
@@ -290,17 +257,75 @@ def test_force(n_p, n_d, n_s, sol, force):
     assert sol.shape == (n_p, n_d*n_s), ("The informed dimensions are not" +
         "consistent with the given solution. Informed dimensions were, " +
         "n_p: {}, n_d: {}, n_s: {}".format(n_p,n_d,n_s))
-    passed = True
-    inst_fail = []
-
-    for p, s in force:
-        if sol[p, s] != 1:
-            passed = False
-            inst_fail.append((p,s))
+    force = np.asarray(force, dtype=np.int64).reshape(-1, 2)
+    missing = sol[force[:, 0], force[:, 1]] != 1
+    inst_fail = [tuple(e) for e in force[missing].tolist()]
+    passed = len(inst_fail) == 0
 
     return passed, inst_fail
 
 
+# One failed check of validate. person, day and slot are None when they
+# don't apply to the rule, e.g. demand is checked per (day, slot).
+Violation = namedtuple('Violation', ['rule', 'person', 'day', 'slot'])
+
+
+def validate(sol, instance, prop=0.5, max_teach=1):
+    """Checks every rule on a solution at once, with whole array operations.
+
+    Args:
+        sol: [ndarray] The (n_p, n_d*n_s) solution to check
+        instance: [tuple] The optimization parameters as returned by
+        read_forms, (n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice,
+        demand)
+        prop: [float] The max proportion of men allowed
+        max_teach: [int] Maximum number of teachers by slot. Default value = 1
+
+    Returns:
+        bool: True if the solution respects every rule, False otherwise.
+        report: A list of Violation(rule, person, day, slot), one for each
+        failing check. The rules are 'demand', 'gender', 'teacher',
+        'maturity', 'no_repeat', 'slot_choice', 'indisp' and 'forced'.
+    """
+    n_p, n_d, n_s, G, T, M, indisp, forced, slot_choice, demand = instance
+    assert isinstance(sol, np.ndarray), "The given solution is not a numpy array."
+    assert sol.shape == (n_p, n_d*n_s), ("The informed dimensions are not" +
+        "consistent with the given solution. Informed dimensions were, " +
+        "n_p: {}, n_d: {}, n_s: {}".format(n_p,n_d,n_s))
+    X = np.int64(sol)
+    Xd = X.reshape(n_p, n_d, n_s)
+    demand = np.asarray(demand).reshape(n_d*n_s)
+    multi = demand > 1
+    report = []
+
+    def add_slots(rule, mask):
+        report.extend(Violation(rule, None, j // n_s, j % n_s)
+                      for j in np.flatnonzero(mask).tolist())
+
+    add_slots('demand', X.sum(axis=0) != demand)
+    # Attribute counts of every slot, (1, n_p) x (n_p, n_d*n_s)
+    attrs = np.int64(np.stack([G, T, M]).reshape(3, n_p))
+    n_men, n_teach, n_mature = attrs.dot(X)
+    add_slots('gender', multi & (n_men > prop * demand))
+    add_slots('teacher', multi & ((n_teach == 0) | (n_teach > max_teach)))
+    add_slots('maturity', multi & (n_mature == 0))
+
+    report.extend(Violation('no_repeat', p, d, None)
+                  for p, d in np.argwhere(Xd.sum(axis=2) > 1).tolist())
+    outside = Xd > np.asarray(slot_choice).reshape(n_p, 1, n_s)
+    report.extend(Violation('slot_choice', p, d, s)
+                  for p, d, s in np.argwhere(outside).tolist())
+    indisp = np.asarray(indisp, dtype=np.int64).reshape(-1, 2)
+    working = Xd[indisp[:, 0], indisp[:, 1]].sum(axis=1) > 0
+    report.extend(Violation('indisp', p, d, None)
+                  for p, d in indisp[working].tolist())
+    forced = np.asarray(forced, dtype=np.int64).reshape(-1, 2)
+    missing = X[forced[:, 0], forced[:, 1]] != 1
+    report.extend(Violation('forced', p, j // n_s, j % n_s)
+                  for p, j in forced[missing].tolist())
+
+    return len(report) == 0, report
+
 
 if __name__ == "__main__":
     pass